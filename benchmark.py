@@ -0,0 +1,459 @@
+from __future__ import division, print_function
+import argparse
+import time
+import numpy as np
+from depth import open_recording
+from scipy.ndimage import filters, measurements, morphology
+from selection import SelectionVoter, SequentialVoter, PointerFilter
+from vision import TableROI, FloorEstimator, Preprocessor, BackgroundModel, LocalEqualizer, RegionLabeler, OrientationEstimator, PlaneFitter, RobustPlaneFitter, intersection
+
+try:
+    import tracemalloc #Only in python 3, without it the memory is not measured
+except ImportError:
+    tracemalloc = None
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Reports of the image processing steps using a recorded session, so they can be measured without the kinect or the robots
+#Usage: python benchmark.py <report> <recording>, or python benchmark.py check for the checks that don't need a recording
+
+#Frames of the recording as the game sees them, the recording is already in mm and in (x, y) order
+def frames(recording, limit):
+    for index in range(min(len(recording), limit)):
+        yield recording.frame(index)
+
+#Memory used by the preprocessing of each frame, from the table cutting to the arm removal and the thresholds of the detection
+def preprocess_report(recording, limit):
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+
+    #The first frame creates the buffers, it is not counted
+    source = frames(recording, limit)
+    first = next(source)
+    floor.update(first)
+    table.update(first, floor)
+    preprocess.run(first, table, floor)
+
+    peaks = [] #Highest memory used by each frame
+    allocations = [] #Memory blocks created and not freed by each frame
+    times = [] #Seconds used by each frame
+    if tracemalloc is not None:
+        tracemalloc.start()
+    for depth in source:
+        if tracemalloc is not None:
+            tracemalloc.clear_traces()
+            before = tracemalloc.take_snapshot()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = time.time()
+
+        floor.update(depth)
+        table.update(depth, floor)
+        image, arm = preprocess.run(depth, table, floor)
+        preprocess.mean_between(image, 0, 2000)
+        preprocess.between(arm, floor.arm[0], floor.arm[1])
+
+        times.append(time.time() - start)
+        if tracemalloc is not None:
+            peaks.append(tracemalloc.get_traced_memory()[1] - start_memory)
+            after = tracemalloc.take_snapshot()
+            allocations.append(sum(max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno')))
+    if tracemalloc is not None:
+        tracemalloc.stop()
+
+    print('Frames: ' + str(len(times)))
+    print('Buffers: ' + str(preprocess.footprint()) + ' bytes for a table of ' + str(preprocess.shape))
+    print('Time per frame: ' + str(round(1000*np.mean(times), 3)) + ' ms')
+    if tracemalloc is not None:
+        print('Peak memory per frame: ' + str(int(np.max(peaks))) + ' bytes (mean ' + str(int(np.mean(peaks))) + ')')
+        print('Allocations per frame: ' + str(int(np.max(allocations))) + ' (mean ' + str(round(np.mean(allocations), 2)) + ')')
+    else:
+        print('Memory not measured, tracemalloc is not available')
+
+#Synthetic kinect frame in mm and (x, y) order: floor at 2600 mm, a table at 1850 mm with two robots and an arm over it and some noise
+def synthetic_frame(random):
+    depth = np.full((320, 240), 2600, dtype = np.uint16)
+    depth[40:280, 30:210] = 1850
+    depth[100:110, 60:70] = 1790 #Robots
+    depth[200:210, 150:160] = 1790
+    depth[150:200, 100:130] = 1300 #Arm
+    depth += random.randint(0, 4, depth.shape).astype(np.uint16)
+    return depth
+
+#Checks that after the first frame the preprocessing and the segmentation with the empty table don't create any image of the table size: the buffers are the same, the memory
+#doesn't grow and the peak of each frame is smaller than one mask of the table. The ufunc buffers are made smaller during the check
+#because numpy uses them for the casts, with the default size they are as big as a mask of the table
+def preprocess_check(count = 30):
+    random = np.random.RandomState(0)
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    model = BackgroundModel(frames = 5)
+
+    #The first frames create the buffers and capture the empty table
+    for index in range(model.frames):
+        first = synthetic_frame(random)
+        floor.update(first)
+        table.update(first, floor)
+        image, arm = preprocess.run(first, table, floor)
+        model.learn(arm, preprocess.between(image, 0, 1820), arm <= floor.robots[0]) #The robots of the synthetic frame are at 1790 mm
+    assert model.ready(), 'The empty table was not captured'
+    names = ('table', 'arm', 'equalized', 'smoothed', 'robots', 'tails', 'band', 'labels', 'mask', 'below', 'values')
+    buffers = [getattr(preprocess, name) for name in names] #Buffers created by the first frame
+    depths = [synthetic_frame(random) for index in range(count)] #Made before measuring so they are not counted
+
+    bufsize = np.getbufsize()
+    np.setbufsize(1024)
+    if tracemalloc is not None:
+        tracemalloc.start()
+    try:
+        for index, depth in enumerate(depths):
+            if tracemalloc is not None:
+                start_memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+
+            floor.update(depth)
+            table.update(depth, floor)
+            image, arm = preprocess.run(depth, table, floor)
+            preprocess.mean_between(image, 0, 2000)
+            preprocess.between(arm, floor.arm[0], floor.arm[1])
+            robots = model.segment(arm)[0]
+            model.learn(arm, robots, model.arm)
+            assert np.count_nonzero(robots) > 0, 'The robots were not segmented'
+
+            if tracemalloc is not None:
+                memory, peak = tracemalloc.get_traced_memory()
+                assert peak - start_memory < preprocess.mask.nbytes, 'A frame used ' + str(peak - start_memory) + ' bytes, a mask of the table has ' + str(preprocess.mask.nbytes)
+                #The objects of the frame before the tracing are not traced, so the first frame traced seems to keep the ones that replace them
+                assert (index == 0) or (memory - start_memory < 1024), 'A frame kept ' + str(memory - start_memory) + ' bytes'
+    finally:
+        if tracemalloc is not None:
+            tracemalloc.stop()
+        np.setbufsize(bufsize)
+
+    assert all(getattr(preprocess, name) is buffer for name, buffer in zip(names, buffers)), 'The buffers were created again'
+    assert image is preprocess.table and arm is preprocess.arm, 'The preprocessing returned new images'
+    print('Preprocessing check passed with ' + str(count) + ' frames' + ('' if tracemalloc is not None else ', memory not measured because tracemalloc is not available'))
+
+#Robot mask and tails mask made from an equalized table with the same thresholds and cleaning detecting uses in play.py
+def robot_mask(depth, equalized):
+    smoothed = filters.uniform_filter(equalized, size=3)
+    robots = smoothed <= np.mean(depth[(depth > 0) & (depth < 2000)])/2.55
+    labels, objects = measurements.label(robots)
+    area = max(np.bincount(labels.ravel())[1:].max(), 1) if objects else 1
+    robots = smoothed <= (31680/area)+402
+    tails = smoothed <= (31680/area)+402+65
+    labels, objects = measurements.label(robots)
+    area = np.bincount(labels.ravel())[1:].max() if objects else 0
+    ite = int(np.rint(area/35))
+    if ite > 0:
+        robots = morphology.binary_opening(robots, np.ones((2,2)), iterations=ite)
+    return morphology.binary_closing(robots, np.ones((2,2)), iterations=4), tails
+
+#Time of the local equalization and difference of the robot masks between rank.equalize and LocalEqualizer with each tile size
+def equalize_report(recording, limit):
+    from skimage.filters import rank
+    import skimage.morphology as morp
+
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    tiles = (1, 2, 4, 8)
+    equalizers = [LocalEqualizer(tile = tile) for tile in tiles]
+    times = [[] for tile in (0,) + tiles] #Seconds per frame, rank.equalize first
+    different = [[] for tile in tiles] #Pixels of the robot mask different from the one of rank.equalize
+    objects = [[] for tile in tiles] #Frames where the number of robots detected is different
+
+    for depth in frames(recording, limit):
+        floor.update(depth)
+        table.update(depth, floor)
+        image = preprocess.run(depth, table, floor)[0]
+
+        start = time.time()
+        reference = rank.equalize(image, morp.disk(14))
+        times[0].append(time.time() - start)
+        mask = robot_mask(image, reference)[0]
+        count = measurements.label(mask)[1]
+
+        for index, equalizer in enumerate(equalizers):
+            start = time.time()
+            equalized = equalizer.run(image, out = preprocess.equalized)
+            times[index + 1].append(time.time() - start)
+            other = robot_mask(image, equalized)[0]
+            different[index].append(np.count_nonzero(other != mask))
+            objects[index].append(measurements.label(other)[1] != count)
+
+    print('Frames: ' + str(len(times[0])))
+    print('rank.equalize: ' + str(round(1000*np.mean(times[0]), 3)) + ' ms per frame')
+    for index, tile in enumerate(tiles):
+        print('LocalEqualizer tile ' + str(tile) + ': ' + str(round(1000*np.mean(times[index + 1]), 3)) + ' ms per frame, ' +
+              str(round(np.mean(different[index]), 2)) + ' different mask pixels per frame (max ' + str(np.max(different[index])) + '), ' +
+              str(np.count_nonzero(objects[index])) + ' frames with a different number of robots')
+
+#Time of the orientation of all the robots with one OrientationEstimator call against one crop, opening and labelling per robot
+def orientation_report(recording, limit):
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    equalizer = LocalEqualizer()
+    labeler = RegionLabeler()
+    estimator = OrientationEstimator(half = 12)
+    times = [[], []] #Seconds per frame of the crops one by one and of the batch
+    difference = [] #Biggest difference of orientation in radians per frame
+    robots = 0
+
+    for depth in frames(recording, limit):
+        floor.update(depth)
+        table.update(depth, floor)
+        image = preprocess.run(depth, table, floor)[0]
+        mask, tails = robot_mask(image, equalizer.run(image))
+        regions = labeler.label(mask)
+        regions = regions.keep(regions.area > np.rint(regions.largest()*6/10))[1]
+        robots += len(regions)
+
+        #One robot at a time, the crops near the edge are cut smaller
+        start = time.time()
+        single = np.zeros(len(regions))
+        for region in range(len(regions)):
+            corner = np.floor(regions.centroid[region] - 12).astype(int)
+            test = tails[max(corner[0], 0):max(corner[0] + 24, 0), max(corner[1], 0):max(corner[1] + 24, 0)]
+            test = morphology.binary_opening(test, np.ones((2,2)), iterations=1)
+            closeUps = labeler.label(test)
+            if len(closeUps) > 0:
+                single[region] = closeUps.orientation[np.argmax(closeUps.area)]
+        times[0].append(time.time() - start)
+
+        start = time.time()
+        batch = estimator.run(tails, regions.centroid)[0]
+        times[1].append(time.time() - start)
+        if len(regions) > 0:
+            difference.append(np.max(np.absolute(single - batch)))
+
+    print('Frames: ' + str(len(times[0])) + ', robots: ' + str(robots))
+    print('One by one: ' + str(round(1000*np.mean(times[0]), 3)) + ' ms per frame')
+    print('OrientationEstimator: ' + str(round(1000*np.mean(times[1]), 3)) + ' ms per frame')
+    if difference:
+        print('Biggest difference: ' + str(np.rad2deg(np.max(difference))) + ' degrees')
+
+#Time and difference of the plane of the arm fitted with PlaneFitter against the statsmodels regression selecting used before
+def plane_report(recording, limit):
+    import pandas as pd
+    import statsmodels.formula.api as smf
+
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    fitter = PlaneFitter()
+    times = [[], []] #Seconds per frame of statsmodels and of PlaneFitter
+    difference = [] #Biggest relative difference of the coefficients per frame
+
+    for depth in frames(recording, limit):
+        floor.update(depth)
+        table.update(depth, floor)
+        arm = preprocess.run(depth, table, floor)[1]
+        highArm, lowArm = floor.arm
+        band = preprocess.between(arm, highArm, lowArm)
+        hand = np.nonzero(band)
+        if len(hand[0]) < 3:
+            continue
+        han = (lowArm - arm[band])*((arm.shape[1]-3-3)/800) #Same scale selecting uses, 800 mm is the table width
+
+        start = time.time()
+        params = smf.ols(formula = 'z ~ x + y', data = pd.DataFrame({'x': hand[0], 'y': hand[1], 'z': han})).fit().params
+        times[0].append(time.time() - start)
+        reference = np.array([params[1], params[2], params[0]])
+
+        start = time.time()
+        coefficients = np.array(fitter.fit(hand[0], hand[1], han))
+        times[1].append(time.time() - start)
+        difference.append(np.max(np.absolute(coefficients - reference)/np.maximum(np.absolute(reference), 1e-9)))
+
+    print('Frames with an arm: ' + str(len(times[0])))
+    if times[0]:
+        print('statsmodels: ' + str(round(1000*np.mean(times[0]), 3)) + ' ms per frame')
+        print('PlaneFitter: ' + str(round(1000*np.mean(times[1]), 3)) + ' ms per frame')
+        print('Biggest relative difference of the coefficients: ' + str(np.max(difference)))
+
+#Point of the table the user points at in one frame with the same steps selecting uses in play.py, None if there is no arm
+def pointed(arm, floor, preprocess, labeler, fitter):
+    highArm, lowArm = floor.arm
+    band = preprocess.between(arm, highArm, lowArm)
+    hand = np.nonzero(band)
+    if not hand[0].any():
+        return None
+    han = (lowArm - arm[band])*((arm.shape[1]-3-3)/800)
+    handc = labeler.label(band, out = preprocess.labels)
+    ang = handc.orientation[0] + np.pi/2
+    slope = np.tan(ang)
+    intercept = handc.centroid[0][1] - slope*handc.centroid[0][0]
+    A, B, C = fitter.fit(hand[0], hand[1], han)
+    return np.array(intersection(A, B, C, slope, intercept))
+
+#Objective of a point like selecting finds it, 1 + the position of the closest zone, 0 if no zone is closer than 50 pixels and None if there is no point
+def closest(zones, point):
+    if point is None:
+        return None
+    distance = np.sqrt((zones[0] - point[0])**2 + (zones[1] - point[1])**2)
+    return 1 + np.argmin(distance) if np.min(distance) <= 50 else 0
+
+#Selections a voter of selecting makes with the objectives pointed in each frame, as (frame where the arm appeared, frame of the selection,
+#objective). Each gesture is scored on its own, the shortcut of selecting for the objective that is already selected is not used
+def voting(picks, voter):
+    voter.clear()
+    selections = []
+    start = None #Frame where the arm appeared
+    for index, pick in enumerate(picks):
+        if pick is None:
+            voter.reset()
+            start = None
+            continue
+        if start is None:
+            start = index
+        if voter.vote(pick) == voter.SELECTED:
+            selections.append((start, index, voter.selected))
+            voter.clear()
+            start = index + 1 #The arm stays so the next selection is counted from here
+    return selections
+
+#Frames to select and wrong selections of the objective pointed in a recorded gesture with PlaneFitter and with RobustPlaneFitter.
+#zones are the objectives in pixels of the cut table as selecting receives them and target is the one the user was pointing, starting at 1
+def pointing_report(recording, limit, zones, target):
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    labeler = RegionLabeler()
+    fitters = (('PlaneFitter', PlaneFitter()), ('RobustPlaneFitter', RobustPlaneFitter()))
+    picks = [[] for fitter in fitters] #Objective pointed per frame with each fitter
+    times = [[] for fitter in fitters] #Seconds per frame with an arm of each fitter
+
+    for depth in frames(recording, limit):
+        floor.update(depth)
+        table.update(depth, floor)
+        arm = preprocess.run(depth, table, floor)[1]
+        for index, (name, fitter) in enumerate(fitters):
+            start = time.time()
+            pick = closest(zones, pointed(arm, floor, preprocess, labeler, fitter))
+            if pick is not None:
+                times[index].append(time.time() - start)
+            picks[index].append(pick)
+
+    print('Frames: ' + str(len(picks[0])) + ', frames with an arm: ' + str(len(times[0])))
+    for index, (name, fitter) in enumerate(fitters):
+        pointing = [pick for pick in picks[index] if pick is not None]
+        selections = voting(picks[index], SelectionVoter())
+        wrong = [objective for first, last, objective in selections if objective != target]
+        print(name + ': ' + str(round(1000*np.mean(times[index]), 3) if times[index] else 0) + ' ms per frame, ' +
+              str(round(100*pointing.count(target)/max(len(pointing), 1), 1)) + '% of the frames on the target')
+        if selections:
+            lengths = [last - first + 1 for first, last, objective in selections]
+            print('    ' + str(len(selections)) + ' selections, ' + str(np.median(lengths)) + ' frames to select (median, max ' + str(np.max(lengths)) +
+                  '), false selection rate ' + str(round(100*len(wrong)/len(selections), 1)) + '%')
+        else:
+            print('    No selections')
+
+#Time to select the objective pointed in a recorded gesture with the fixed 10/22 votes and with the sequential test selecting uses,
+#zones and target are given like in the pointing report
+def selection_report(recording, limit, zones, target):
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    labeler = RegionLabeler()
+    fitter = RobustPlaneFitter()
+    picks = [] #Objective pointed per frame
+
+    for depth in frames(recording, limit):
+        floor.update(depth)
+        table.update(depth, floor)
+        arm = preprocess.run(depth, table, floor)[1]
+        picks.append(closest(zones, pointed(arm, floor, preprocess, labeler, fitter)))
+
+    print('Frames: ' + str(len(picks)) + ', frames with an arm: ' + str(len(picks) - picks.count(None)))
+    for name, voter in (('Fixed 10/22 votes', SelectionVoter()), ('Sequential test', SequentialVoter())):
+        selections = voting(picks, voter)
+        if not selections:
+            print(name + ': no selections')
+            continue
+        lengths = [last - first + 1 for first, last, objective in selections]
+        seconds = [recording.times[last] - recording.times[first] for first, last, objective in selections]
+        wrong = [objective for first, last, objective in selections if objective != target]
+        print(name + ': ' + str(len(selections)) + ' selections, false selection rate ' + str(round(100*len(wrong)/len(selections), 1)) + '%')
+        print('    Frames to select: median ' + str(np.median(lengths)) + ', p95 ' + str(np.percentile(lengths, 95)))
+        print('    Time to select: median ' + str(round(1000*np.median(seconds), 1)) + ' ms, p95 ' + str(round(1000*np.percentile(seconds, 95), 1)) + ' ms')
+
+#Shaking, vote stability and lag of the point pointed in a recorded gesture with and without PointerFilter, zones and target are given like in
+#the pointing report. The lag is the delay in frames that makes the raw points closest to the filtered ones
+def pointer_report(recording, limit, zones, target):
+    floor = FloorEstimator()
+    table = TableROI()
+    preprocess = Preprocessor()
+    labeler = RegionLabeler()
+    fitter = RobustPlaneFitter()
+    pointer = PointerFilter()
+    points = [[], []] #Point per frame without and with the filter, None if there is no arm
+
+    for index, depth in enumerate(frames(recording, limit)):
+        floor.update(depth)
+        table.update(depth, floor)
+        arm = preprocess.run(depth, table, floor)[1]
+        point = pointed(arm, floor, preprocess, labeler, fitter)
+        if point is None or not np.all(np.isfinite(point)):
+            pointer.reset() #Like selecting the filter starts again with each pointing
+            point = None
+        points[0].append(point)
+        points[1].append(None if point is None else pointer.filter(point, recording.times[index]))
+
+    print('Frames: ' + str(len(points[0])) + ', frames with an arm: ' + str(sum(point is not None for point in points[0])))
+    pairs = [index for index in range(1, len(points[0])) if points[0][index] is not None and points[0][index - 1] is not None]
+    for name, series in (('Raw', points[0]), ('PointerFilter', points[1])):
+        picks = [closest(zones, point) for point in series]
+        steps = [np.hypot(*(series[index] - series[index - 1])) for index in pairs]
+        flips = [index for index in pairs if picks[index] != picks[index - 1]]
+        pointing = [pick for pick in picks if pick is not None]
+        selections = voting(picks, SequentialVoter())
+        print(name + ': ' + str(round(np.mean(steps), 2) if steps else 0) + ' px moved per frame, ' + str(len(flips)) + ' votes changed, ' +
+              str(round(100*pointing.count(target)/max(len(pointing), 1), 1)) + '% of the frames on the target, ' + str(len(selections)) + ' selections')
+
+    #Delay between the filtered and the raw points
+    errors = []
+    for lag in range(11):
+        distances = [np.hypot(*(points[1][index] - points[0][index - lag])) for index in range(lag, len(points[0]))
+                     if points[1][index] is not None and points[0][index - lag] is not None]
+        errors.append(np.mean(distances) if distances else np.inf)
+    lag = int(np.argmin(errors))
+    print('Lag: ' + str(lag) + ' frames (' + str(round(1000*lag*np.median(np.diff(recording.times)), 1)) + ' ms)')
+
+REPORTS = {
+    'preprocess': preprocess_report,
+    'equalize': equalize_report,
+    'orientation': orientation_report,
+    'plane': plane_report,
+    'pointing': pointing_report,
+    'selection': selection_report,
+    'pointer': pointer_report,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measures the image processing with a recorded session')
+    parser.add_argument('report', choices = sorted(REPORTS) + ['check'], help = 'Step to measure, check runs the checks with synthetic frames')
+    parser.add_argument('recording', nargs = '?', help = 'Depth recording made with play.py --record')
+    parser.add_argument('--frames', type = int, default = 300, help = 'Maximum number of frames used')
+    parser.add_argument('--zones', help = 'Objectives of the pointing, selection and pointer reports as row,column pairs of the cut table separated by spaces, like "60,40 200,150"')
+    parser.add_argument('--target', type = int, help = 'Objective pointed in the recording for the pointing, selection and pointer reports, starting at 1')
+    args = parser.parse_args()
+
+    if args.report == 'check':
+        preprocess_check()
+        return
+    if args.recording is None:
+        parser.error('the ' + args.report + ' report needs a recording')
+    if args.report in ('pointing', 'selection', 'pointer'):
+        if args.zones is None or args.target is None:
+            parser.error('the ' + args.report + ' report needs --zones and --target')
+        zones = np.array([[float(value) for value in zone.split(',')] for zone in args.zones.split()]).T
+        REPORTS[args.report](open_recording(args.recording), args.frames, zones, args.target)
+    else:
+        REPORTS[args.report](open_recording(args.recording), args.frames)
+
+if __name__ == '__main__':
+    main()
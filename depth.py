@@ -0,0 +1,455 @@
+from __future__ import division
+import numpy as np
+import collections
+import threading
+import ctypes
+import time
+import zlib
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Depth ingestion for the kinect frames. Each frame is copied only once into a preallocated slot of a ring and then
+#its values are decoded to mm in the same slot, so no new arrays are created in the 30 fps callback
+
+#The kinect gives 16 bits per pixel, the first 3 bits are the player index and the next 12 bits are the depth in mm
+DEPTH_SHIFT = 3
+DEPTH_MASK = 4095
+
+#Ring of preallocated uint16 buffers where the kinect frames are copied
+class DepthRing(object):
+
+    def __init__(self, slots, winsize):
+        width, height = winsize #Same (width, height) order used for the pygame surfaces
+        self.buffers = np.zeros((slots, height, width), dtype = np.uint16) #Every slot is allocated once, the kinect copies the rows one after the other
+        self.addresses = [self.buffers[i].ctypes.data for i in range(slots)] #Address of each slot so the kinect can copy the raw bits directly in it
+        self.views = [] #Read only views of each slot
+
+        for i in range(slots):
+            #The transposed view keeps the (x, y) indexing that pygame.surfarray.pixels2d used to give so the table cutting doesn't change
+            view = self.buffers[i].T
+            view.flags.writeable = False
+            self.views.append(view)
+
+        self.held = [False]*slots #Slots that can't be overwritten because their frame is still being used
+        self.lock = threading.Lock() #The slots are held by the kinect thread and released by the game thread
+        self.slot = -1 #Slot with the last frame copied
+        self.frames = 0 #Number of frames received since the ring was created
+
+    #Copies the raw data of a kinect frame in the next free slot and decodes it in place, returns the slot used that stays held until it is released
+    def ingest(self, frame):
+        with self.lock:
+            slot = self.slot
+            for i in range(len(self.buffers)):
+                slot = (slot + 1) % len(self.buffers) #The oldest slots are overwritten first
+                if not self.held[slot]:
+                    break
+            else:
+                raise RuntimeError('All the depth slots are held, the ring needs more slots than the frame queue')
+            self.held[slot] = True
+
+        frame.image.copy_bits(self.addresses[slot]) #Only copy of the frame, made directly by the kinect in the preallocated memory
+        self.decode(slot)
+        self.slot = slot
+        self.frames += 1
+        return slot
+
+    #Allows the slot to be overwritten by a new frame
+    def release(self, slot):
+        with self.lock:
+            self.held[slot] = False
+
+    #Converts the raw kinect values of a slot to depth in mm without creating new arrays
+    def decode(self, slot):
+        buffer = self.buffers[slot]
+        np.right_shift(buffer, DEPTH_SHIFT, out = buffer) #Deletes the player index
+        np.bitwise_and(buffer, DEPTH_MASK, out = buffer) #Keeps only the 12 bits of depth
+
+    #Returns the read only depth image of a slot in mm
+    def view(self, slot):
+        return self.views[slot]
+
+    #Returns the read only depth image of the last frame received
+    def latest(self):
+        if self.slot < 0:
+            return None
+        return self.views[self.slot]
+
+
+#Bounded queue between the kinect callback (producer) and the game (consumer), when it is full the oldest frame is dropped
+class FrameQueue(object):
+
+    def __init__(self, capacity, release = None):
+        self.capacity = capacity #Maximum number of frames waiting
+        self.release = release #Method called with each dropped frame so its slot can be used again
+        self.frames = collections.deque() #Frames waiting to be used by the game, the newest at the right
+        self.condition = threading.Condition() #Wakes up the game when a frame arrives
+
+        #Counters to know if the game is falling behind the kinect
+        self.received = 0 #Frames put in the queue
+        self.dropped = 0 #Frames that were never used by the game
+        self.max_depth = 0 #Maximum number of frames that have been waiting at the same time
+
+    #Adds a new frame, never blocks the kinect callback
+    def put(self, frame):
+        with self.condition:
+            if len(self.frames) >= self.capacity:
+                self._drop(self.frames.popleft()) #Drop oldest policy
+            self.frames.append(frame)
+            self.received += 1
+            self.max_depth = max(self.max_depth, len(self.frames))
+            self.condition.notify()
+
+    #Waits for a frame and returns the newest one, the older frames waiting are dropped because the game only needs the last one
+    #Returns None if no frame arrived before the timeout in seconds
+    def get_latest(self, timeout = None):
+        with self.condition:
+            if not self.frames:
+                self.condition.wait(timeout)
+            if not self.frames:
+                return None
+            frame = self.frames.pop()
+            while self.frames:
+                self._drop(self.frames.popleft())
+            return frame
+
+    def _drop(self, frame):
+        self.dropped += 1
+        if self.release is not None:
+            self.release(frame)
+
+    #Number of frames currently waiting
+    def depth(self):
+        return len(self.frames)
+
+    #Returns (received, dropped, current depth, maximum depth)
+    def stats(self):
+        with self.condition:
+            return self.received, self.dropped, len(self.frames), self.max_depth
+
+
+#-----------------------------------------Recorded sessions-----------------------------------------
+
+#A recording has a header with the size of the frames and then each frame as a record with its timestamp in seconds and the depth in mm
+RECORDING_MAGIC = b'STSD'
+RECORDING_HEADER = np.dtype([('magic', 'S4'), ('version', '<u2'), ('width', '<u2'), ('height', '<u2'), ('reserved', '<u2', (3,))])
+
+#A compressed recording has the same header, then each frame compressed (complete for the key frames and as the difference with the previous
+#frame for the rest), then the index with the time and position of every frame and at the end a footer to find the index
+COMPRESSED_MAGIC = b'STSZ'
+COMPRESSED_INDEX = np.dtype([('time', '<f8'), ('offset', '<u8'), ('size', '<u4'), ('key', 'u1'), ('reserved', 'u1', (3,))])
+COMPRESSED_FOOTER = np.dtype([('index', '<u8'), ('frames', '<u8'), ('magic', 'S4'), ('reserved', '<u4')])
+INDEX_MAGIC = b'STSI'
+
+#Type of each record of a recording with frames of the given size
+def recording_dtype(winsize):
+    width, height = winsize
+    return np.dtype([('time', '<f8'), ('depth', '<u2', (height, width))])
+
+#Opens a recorded session checking if it is compressed or not
+def open_recording(path):
+    header = np.fromfile(path, dtype = RECORDING_HEADER, count = 1)
+    if len(header) == 1:
+        if header['magic'][0] == RECORDING_MAGIC:
+            return DepthRecording(path, header[0])
+        if header['magic'][0] == COMPRESSED_MAGIC:
+            return CompressedRecording(path, header[0])
+    raise ValueError(path + ' is not a depth recording')
+
+#Recorded session read with a memory map, so the frames are only read from the disk when they are used
+class DepthRecording(object):
+
+    def __init__(self, path, header):
+        self.winsize = int(header['width']), int(header['height'])
+        self.records = np.memmap(path, dtype = recording_dtype(self.winsize), mode = 'r', offset = RECORDING_HEADER.itemsize)
+        self.times = self.records['time'] #Timestamp of each frame in seconds
+
+    def __len__(self):
+        return len(self.records)
+
+    #Depth in mm of a frame as a (rows, columns) array
+    def frame(self, index):
+        return self.records['depth'][index]
+
+    #Position of the last frame recorded before the given time in seconds
+    def seek(self, time):
+        return max(np.searchsorted(self.times, time, side = 'right') - 1, 0)
+
+
+#Compressed recorded session, the file is memory mapped and the index allows to decode any frame starting from the key frame before it
+class CompressedRecording(object):
+
+    def __init__(self, path, header):
+        self.winsize = int(header['width']), int(header['height'])
+        self.data = np.memmap(path, dtype = np.uint8, mode = 'r')
+
+        footer = self.data[len(self.data) - COMPRESSED_FOOTER.itemsize:].view(COMPRESSED_FOOTER)[0]
+        if footer['magic'] != INDEX_MAGIC:
+            raise ValueError(path + ' has no index, the recording was not closed')
+        start = int(footer['index'])
+        self.index = self.data[start:start + int(footer['frames'])*COMPRESSED_INDEX.itemsize].view(COMPRESSED_INDEX)
+        self.times = self.index['time'] #Timestamp of each frame in seconds
+        self.keys = np.flatnonzero(self.index['key']) #Positions of the key frames
+
+        width, height = self.winsize
+        self.current = np.zeros((height, width), dtype = np.uint16) #Last frame decoded
+        self.position = -1 #Position of the last frame decoded
+
+    def __len__(self):
+        return len(self.index)
+
+    #Depth in mm of a frame as a (rows, columns) array, the array is reused by the next frame decoded
+    def frame(self, index):
+        key = self.keys[np.searchsorted(self.keys, index, side = 'right') - 1] #Key frame before the one asked
+        if (index < self.position) | (self.position < key):
+            self.position = key - 1 #Starts again from the key frame instead of decoding all the frames before it
+        while self.position < index:
+            self.position += 1
+            self.decode(self.position)
+        return self.current
+
+    def decode(self, position):
+        record = self.index[position]
+        start = int(record['offset'])
+        values = np.frombuffer(zlib.decompress(self.data[start:start + int(record['size'])].tobytes()), dtype = np.uint16).reshape(self.current.shape)
+        if record['key']:
+            self.current[:] = values
+        else:
+            self.current += values #The differences are stored modulo 2^16 so the sum gives back the exact frame
+
+    #Position of the last frame recorded before the given time in seconds
+    def seek(self, time):
+        return max(np.searchsorted(self.times, time, side = 'right') - 1, 0)
+
+
+#Saves the depth frames in a compressed recording from a background thread so the game is never delayed by the disk
+#Each frame is stored as the difference with the previous one except one key frame every keyframes frames, and compressed with fast zlib
+class DepthRecorder(object):
+
+    def __init__(self, path, winsize, keyframes = 30, slots = 60):
+        width, height = winsize
+        self.output = open(path, 'wb')
+        header = np.zeros(1, dtype = RECORDING_HEADER)
+        header['magic'] = COMPRESSED_MAGIC
+        header['version'] = 1
+        header['width'] = width
+        header['height'] = height
+        header['reserved'][0][0] = keyframes
+        header.tofile(self.output)
+
+        self.keyframes = keyframes
+        self.pool = np.zeros((slots, height, width), dtype = np.uint16) #Copies of the frames waiting to be written
+        self.times = np.zeros(slots) #Time of each frame waiting
+        self.free = collections.deque(range(slots)) #Slots of the pool that can be used
+        self.waiting = collections.deque() #Slots with frames waiting to be written in order
+        self.condition = threading.Condition()
+
+        self.previous = np.zeros((height, width), dtype = np.uint16) #Last frame written to calculate the differences
+        self.difference = np.zeros((height, width), dtype = np.uint16)
+        self.index = [] #Time, offset, size and key of every frame written
+        self.written = 0 #Frames written
+        self.dropped = 0 #Frames not recorded because the writer was behind and the pool was full
+        self.bytes = 0 #Compressed bytes written
+
+        self.running = True
+        self.thread = threading.Thread(target = self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #Copies a frame of depth in mm as a (rows, columns) array to be written, it only copies the frame and never waits for the disk
+    def write(self, frame, time):
+        with self.condition:
+            if not self.free:
+                self.dropped += 1
+                return False
+            slot = self.free.popleft()
+        np.copyto(self.pool[slot], frame)
+        self.times[slot] = time
+        with self.condition:
+            self.waiting.append(slot)
+            self.condition.notify()
+        return True
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running & (not self.waiting):
+                    self.condition.wait()
+                if not self.waiting:
+                    break
+                slot = self.waiting.popleft()
+
+            key = self.written % self.keyframes == 0
+            if key:
+                data = zlib.compress(self.pool[slot].tobytes(), 1)
+            else:
+                np.subtract(self.pool[slot], self.previous, out = self.difference) #Most of the table doesn't change so the difference is mostly zeros
+                data = zlib.compress(self.difference.tobytes(), 1)
+            self.previous[:] = self.pool[slot]
+            self.index.append((self.times[slot], self.output.tell(), len(data), key, (0, 0, 0)))
+            self.output.write(data)
+            self.written += 1
+            self.bytes += len(data)
+
+            with self.condition:
+                self.free.append(slot)
+
+    #Writes the frames still waiting, the index and the footer
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+        footer = np.zeros(1, dtype = COMPRESSED_FOOTER)
+        footer['index'] = self.output.tell()
+        footer['frames'] = len(self.index)
+        footer['magic'] = INDEX_MAGIC
+        np.array(self.index, dtype = COMPRESSED_INDEX).tofile(self.output)
+        footer.tofile(self.output)
+        self.output.close()
+
+
+#Saves frames in a recording that can be replayed, times in seconds and frames as (rows, columns) arrays of depth in mm
+def save_recording(path, times, frames):
+    frames = np.asarray(frames, dtype = np.uint16)
+    header = np.zeros(1, dtype = RECORDING_HEADER)
+    header['magic'] = RECORDING_MAGIC
+    header['version'] = 1
+    header['height'], header['width'] = frames.shape[1:3]
+
+    records = np.zeros(len(frames), dtype = recording_dtype((frames.shape[2], frames.shape[1])))
+    records['time'] = times
+    records['depth'] = frames
+    with open(path, 'wb') as output:
+        header.tofile(output)
+        records.tofile(output)
+
+
+#Handler list that allows to use += and -= like the events of pykinect
+class ReplayEvent(object):
+
+    def __init__(self):
+        self.handlers = []
+
+    def __iadd__(self, handler):
+        self.handlers.append(handler)
+        return self
+
+    def __isub__(self, handler):
+        self.handlers.remove(handler)
+        return self
+
+    def fire(self, *args):
+        for handler in self.handlers:
+            handler(*args)
+
+
+#Image of a replayed frame, copies the recorded depth in the same raw format of the kinect (depth shifted after the player index)
+class ReplayImage(object):
+
+    def __init__(self, winsize):
+        width, height = winsize
+        self.shape = height, width
+        self.depth = None #Recorded depth in mm of the current frame
+        self.destinations = {} #Arrays already created for each address the frames are copied to
+
+    def copy_bits(self, address):
+        if address not in self.destinations:
+            size = self.shape[0]*self.shape[1]
+            self.destinations[address] = np.ctypeslib.as_array((ctypes.c_uint16*size).from_address(address)).reshape(self.shape)
+        np.left_shift(self.depth, DEPTH_SHIFT, out = self.destinations[address])
+
+
+#Frame sent to the depth_frame_ready callback, has the same attributes used from the kinect frames
+class ReplayFrame(object):
+
+    def __init__(self, winsize):
+        self.image = ReplayImage(winsize)
+        self.frame_number = 0
+        self.timestamp = 0
+
+
+class ReplayStream(object):
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    #Same arguments of the kinect depth stream, the recording already defines the resolution so they are ignored
+    def open(self, *args):
+        self.runtime.start()
+
+
+class ReplayCamera(object):
+
+    def __init__(self):
+        self.elevation_angle = 0 #The recording can't move the camera
+
+
+#Replaces nui.Runtime with a recorded session, the frames are sent to the same depth_frame_ready callback
+#speed 1 plays at the recorded rate, other values play at that multiple of the rate and 0 plays as fast as possible
+class ReplayRuntime(object):
+
+    def __init__(self, path, speed = 1, loop = False):
+        self.recording = open_recording(path)
+        self.speed = speed
+        self.loop = loop #Starts again from the first frame when the recording is over
+        self.depth_frame_ready = ReplayEvent()
+        self.depth_stream = ReplayStream(self)
+        self.camera = ReplayCamera()
+        self.running = False
+        self.thread = None
+
+        #Frames sent and time used to send them to know the real frames per second of the replay
+        self.frames = 0
+        self.elapsed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def start(self):
+        if self.thread is None:
+            self.running = True
+            self.thread = threading.Thread(target = self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def close(self):
+        self.running = False
+        if (self.thread is not None) and (self.thread is not threading.current_thread()):
+            self.thread.join()
+        self.thread = None
+
+    #Sends the frames with the same time separation they were recorded divided by the speed
+    def run(self):
+        frame = ReplayFrame(self.recording.winsize)
+        times = self.recording.times
+        start = time.time()
+
+        while self.running:
+            beginning = time.time() #Wall time when this pass of the recording started
+            for index in range(len(self.recording)):
+                if not self.running:
+                    break
+                if self.speed > 0:
+                    wait = beginning + (times[index] - times[0])/self.speed - time.time()
+                    if wait > 0:
+                        time.sleep(wait)
+                frame.image.depth = self.recording.frame(index)
+                frame.frame_number = index
+                frame.timestamp = times[index]
+                self.depth_frame_ready.fire(frame)
+                self.frames += 1
+                self.elapsed = time.time() - start
+            if not self.loop:
+                break
+        self.running = False
+
+    #Frames per second really sent since the replay started
+    def fps(self):
+        if self.elapsed == 0:
+            return 0
+        return self.frames/self.elapsed
@@ -1219,11 +1219,8 @@ class ePuck():
 	#Method that controls the movements of the e-puck
 	def move(self, arr2d):
 
-	    if (self.moving) & (35 < np.absolute(self.angAnt-self.orientation) < 90): #Checks if the angle has changed more than 35 in which
-	    # case is a mistake in the robot orientation found, but if its over 90 its due to the change from negative to positive in X axis
-	    	self.orientation = cp.copy(self.angAnt)
-
-	    self.angAnt = cp.copy(self.orientation) #Saves the current angle to check with it next iteration
+	    #The orientation comes from the pose filter of the robot, that already ignores the orientations that jump between frames
+	    self.angAnt = cp.copy(self.orientation) #Saves the current angle
 
 	    angObj = -1*np.rad2deg(np.arctan((self.objective[0]-self.coors[0])/(self.objective[1]-self.coors[1]))) #Calculates the angle between the robots position and the objective
 	    #proportional = angObj - self.orientation #This substraction is if for any reason you don't want to flip the kinect image
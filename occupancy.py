@@ -0,0 +1,60 @@
+from __future__ import division
+import numpy as np
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Free space of the screen to put new trash
+
+#The screen divided in square cells with the number of things over each cell: the walls, the bases of the robots, the buttons and texts and
+#the trash. Adding or removing a rectangle only changes its cells, and a free place for a rectangle is chosen at random from all the places
+#where it fits with one pass over the cells, so it takes the same time with an empty or a full screen and says when there is no place
+class OccupancyGrid(object):
+
+    def __init__(self, width, height, cell = 20, seed = None):
+        self.cell = cell #Size of a cell in pixels
+        self.counts = np.zeros((int(np.ceil(height/cell)), int(np.ceil(width/cell))), dtype = np.int32) #Things over each cell, by row and column
+        self.random = np.random.RandomState(seed) #Chooses the place between the free ones
+
+    #Cells covered by a rectangle (x, y, width, height) in pixels, as first and last row and first and last column without including the last
+    def cells(self, rect):
+        x, y, width, height = rect[0], rect[1], rect[2], rect[3]
+        rows, columns = self.counts.shape
+        top = min(max(int(np.floor(y/self.cell)), 0), rows)
+        bottom = min(max(int(np.ceil((y + height)/self.cell)), 0), rows)
+        left = min(max(int(np.floor(x/self.cell)), 0), columns)
+        right = min(max(int(np.ceil((x + width)/self.cell)), 0), columns)
+        return top, bottom, left, right
+
+    #Marks the cells of a rectangle as used, returns them so the same cells are freed even if the rectangle moves
+    def add(self, rect):
+        top, bottom, left, right = box = self.cells(rect)
+        self.counts[top:bottom, left:right] += 1
+        return box
+
+    #Frees the cells returned by add
+    def remove(self, box):
+        top, bottom, left, right = box
+        self.counts[top:bottom, left:right] -= 1
+
+    #Frees all the cells
+    def clear(self):
+        self.counts[:] = 0
+
+    #Corner (x, y) in pixels of a random free place for a rectangle of that size, None if there is no place
+    def sample(self, width, height):
+        rows = int(np.ceil(height/self.cell)) #Cells needed by the rectangle
+        columns = int(np.ceil(width/self.cell))
+        if rows > self.counts.shape[0] or columns > self.counts.shape[1]:
+            return None
+
+        #Used cells in every block of rows x columns cells from the sums of the used cells above and to the left of each cell
+        sums = np.zeros((self.counts.shape[0] + 1, self.counts.shape[1] + 1), dtype = np.int32)
+        np.cumsum(np.cumsum(self.counts > 0, axis = 0), axis = 1, out = sums[1:, 1:])
+        used = sums[rows:, columns:] - sums[:-rows, columns:] - sums[rows:, :-columns] + sums[:-rows, :-columns]
+
+        places = np.flatnonzero(used == 0)
+        if len(places) == 0:
+            return None
+        row, column = np.unravel_index(places[self.random.randint(len(places))], used.shape)
+        return int(column*self.cell), int(row*self.cell)
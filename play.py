@@ -1,25 +1,29 @@
 from __future__ import division
 from scipy import stats, constants
-from scipy.ndimage import measurements, morphology, filters, interpolation
-from skimage.measure import regionprops
-from skimage.filters import rank
+from scipy.ndimage import morphology, filters, interpolation
 from mpl_toolkits.mplot3d import Axes3D
-from matplotlib import pyplot as pl
-from collections import Counter
-from pykinect import nui
 from ePuck import ePuck
-import statsmodels.formula.api as smf
-import skimage.morphology as morp
-import statsmodels.api as sm
-import pandas as pd
+from depth import DepthRing, FrameQueue, ReplayRuntime, DepthRecorder
+from vision import TableROI, FloorEstimator, Preprocessor, LocalEqualizer, RegionLabeler, SearchWindows, OrientationEstimator, BackgroundModel, RobustPlaneFitter, intersection
+from tracking import PoseFilter, assign
+from selection import SequentialVoter, PointerFilter, TargetRegistry, AssignmentIndex
+from occupancy import OccupancyGrid
+from timing import GameTimers, FixedStep
 import numpy as np
 import time as ti
 import sys
-import ctypes
 import thread
 import pygame
 import random
 import cython
+import argparse
+import traceback
+
+#The kinect library only works in windows, without it the game can only run with recorded sessions
+try:
+    from pykinect import nui
+except ImportError:
+    nui = None
 
 #Save the sea by Andres Cubides
 #In case of any question write to andrescamiloc@hotmail.com
@@ -47,14 +51,55 @@ GREEN = (0, 247, 0)
 RED = (254, 0, 0)
 BLUE = (1, 175, 247)
 
-#Fixed size of surface for kinect depth data
+#Fixed size of the kinect depth data
 DEPTH_WINSIZE = 320,240
-tmp_s = pygame.Surface(DEPTH_WINSIZE, 0, 16)
+#Maximum number of depth frames waiting for the game, if the game is slower the oldest frames are dropped
+FRAME_QUEUE_SIZE = 2
+#Preallocated buffers where the kinect copies each depth frame, the frames are decoded in place to mm
+#Two extra slots are needed for the frame the game is using and the one the kinect is copying
+depth_ring = DepthRing(FRAME_QUEUE_SIZE + 2, DEPTH_WINSIZE)
+#Frames copied by the kinect waiting to be used by the game
+frame_queue = FrameQueue(FRAME_QUEUE_SIZE, depth_ring.release)
+#Saves the depth frames of the session when the game is started with --record
+recorder = None
+#Position of the table in the kinect image, searched only when the game starts or if the table moves
+table = TableROI()
+#Floor depth used as reference for the game heights
+floor = FloorEstimator()
+#Preallocated images used to process each frame
+preprocess = Preprocessor()
+#Local equalization of the table, a disk of 14 pixels of radius counted exactly for each pixel like rank.equalize
+equalizer = LocalEqualizer(radius = 14, shape = 'disk', tile = 1)
+#Labels the connected regions and measures them
+labeler = RegionLabeler()
+#Windows around the robots to detect them without processing the whole table
+windows = SearchWindows()
+#Orientation of the robots from a square of 24x24 pixels around each one
+orientation = OrientationEstimator(half = 12)
+#Depth of the empty table to find the robots and the arm with one subtraction
+table_model = BackgroundModel()
+#Plane of the arm used to find where the user is pointing, the fingers, the sleeve and the noise of the depth are left out of it
+plane = RobustPlaneFitter(iterations = 64, threshold = 2.0)
+#Votes of the objective pointed each frame, the objective is selected as soon as the votes are enough to be sure and at most after 22 votes
+voter = SequentialVoter(hit = 0.85, confusion = 0.3, false_selection = 0.01, missed = 0.05, minimum = 5, window = 22)
+#Smooths the point the user is pointing at, more when the hand is still and less when it moves
+pointer = PointerFilter(cutoff = 1.0, beta = 0.05, derivative_cutoff = 1.0)
+#Trash each robot is cleaning and robot cleaning each trash
+assignments = AssignmentIndex()
+#Deadlines of the new trash and of the decomposition of each trash in the time played, the pauses don't count
+timers = GameTimers()
+SPAWN = 'spawn' #Event of a new trash appearing
+DECOMPOSE = 'decompose' #Event of a trash contaminating the water, it disappears the fourth time
+#Steps of the game rules, 30 per second whatever the frames the vision can process
+rules = FixedStep(step = 1000/30, limit = 5)
 
 #Game screen size
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 697
 
+#Space of the screen used by the walls, the bases of the robots, the buttons, the texts and the trash, in cells of 20 pixels
+occupancy = OccupancyGrid(SCREEN_WIDTH, SCREEN_HEIGHT, cell = 20)
+
 tableWidth = 800
 
 projectionLength = 1180
@@ -63,33 +108,6 @@ screen_lock = thread.allocate()
 screen = None
 #----------------------------------------------------------------------------------------
 
-#-----------------------------Needed to make kinect depth work---------------------------
-#Source: https://github.com/Microsoft/PTVS/blob/master/Python/Product/PyKinect/PyKinect/PyGameDemo.py
-
-if hasattr(ctypes.pythonapi, 'Py_InitModule4'):
-   Py_ssize_t = ctypes.c_int
-elif hasattr(ctypes.pythonapi, 'Py_InitModule4_64'):
-   Py_ssize_t = ctypes.c_int64
-else:
-   raise TypeError("Cannot determine type of Py_ssize_t")
-
-_PyObject_AsWriteBuffer = ctypes.pythonapi.PyObject_AsWriteBuffer
-_PyObject_AsWriteBuffer.restype = ctypes.c_int
-_PyObject_AsWriteBuffer.argtypes = [ctypes.py_object,
-                                  ctypes.POINTER(ctypes.c_void_p),
-                                  ctypes.POINTER(Py_ssize_t)]
-
-def surface_to_array(surface):
-   buffer_interface = surface.get_buffer()
-   address = ctypes.c_void_p()
-   size = Py_ssize_t()
-   _PyObject_AsWriteBuffer(buffer_interface,
-                          ctypes.byref(address), ctypes.byref(size))
-   bytes = (ctypes.c_byte * size.value).from_address(address.value)
-   bytes.object = buffer_interface
-   return bytes
-#----------------------------------------------------------------------------------------
-
 #--------------------------------------Sprites Classes-----------------------------------
 
 #Type of sprite to display images of titles (Score: and Contamination:)
@@ -225,10 +243,10 @@ class Trash(pygame.sprite.Sprite):
             self.trash_type = 3
 
         self.layer = 2 #Define to be blitted in the layered sprite group all_sprites
-        self.array_position = None #Define the position in the objectives array if the trash is active
-        self.cleaner_id = None #Indicates which robot has been asigned to clean it, goes from 0 to 3 to index the robots, will be asigned if the robot has the same type of trash
+        self.target_id = None #Number of the trash in the objectives of the selection while it is in the screen, it doesn't change when other trash disappears
+        self.cells = None #Cells of the screen used by the trash while it is in the screen
         self.image = image
-        self.time = None #Stores the time since it appears or since it decomposed to know if it have to be decomposed again
+        self.timer = None #Event of the next decomposition of the trash while it is in the screen
         self.decomposing = 0 #Number of times the trash has contaminated the screen, maximum set to 4 and then it disappears
         self.rect = self.image.get_rect() #Rectangle with the dimensions of the image and lets update position in the screen with rect.x and rect.y
 
@@ -258,6 +276,8 @@ class ScreenRobot(pygame.sprite.Sprite):
 
         if sprite_id < 4:
             screen_robots.add(self) #Only actual robots position is used to locate collitions not the base sprite
+        else:
+            occupancy.add(self.rect) #No trash is put in the base
         all_sprites.add(self, layer = self.layer) #Adds sprites to the layered group of active sprites
 
 
@@ -376,62 +396,29 @@ def log(text):
 def error(text):
     print(''.join(('\033', '[Error] ', str(text))))
 
-#Use mathematical morphologic operations to delete small areas form the robot image, ite defines the number of iterarions to clean
+#Use mathematical morphologic operations to delete small areas form the robot image (True where the robots are), ite defines the number of iterarions to clean
 def deleting(im, ite):
-    im = 1*(im <128)
     im_open = morphology.binary_opening(im,np.ones((2,2)),iterations=ite) #Deletes small areas
     im_close = morphology.binary_closing(im_open,np.ones((2,2)),iterations=4) #Make the areas bigger again
     return im_close 
 
-#Deletes the position of trash from the objectives vector when it disappears, recieve the position of the trash in the objectives vector
-def remove_trash_position(array_position):
-    global sel #Vector to store the sequence of selections to fin the most common
-    global freq #Stores the value of the most frequent selection in the first 10 selections, in case there is a mistake due to the 
-    #3D pointing vector uncertainty showing no selection, if the correct selections of an objective is at least 7 from 10 the tentative selection is made
-    global s #Selection counter
-    global newZones #Vector with the positions of the trash in the screen
-    global active_trash #Sprite group with all the trash in the screen
-    
-    #The objectives vector includes the 4 robots and the pause button (positioned from 0 to 4th index) so thats why 5 need to be substracted
-    #so the position its remapped to the vector of only trash called newZones in case of being the first trash will be 5th index in the objectives and 0 in newZones
-    newZones = np.delete(newZones, array_position-5, 1) #Deletes the trash coordinates from the vector, the argument 1 is to delete the column because coordinates X and Y are stored per column
-    #EX: if the position deleted is 6th in objectives the its 6-5 =1 in newZones, and if current newZones = [coors0 , coors1, coors2, coors3] then the result will be newZones = [coors0, coors2, coors3]
-   
-    #sel is a vector that contains a sequence of the objectives selected if the most common value in the vector have enough repetitions (at least 7 from 10)
-    #an objective can be selected, if there is a selection taking place while a trash is deleted the indexes that has been stored in the vector may change because one position was deleted
-    #sel stored position start in 1 not in 0 because 0 indicates no selection, thats why 1 needs to be added
-    sel[(sel == array_position + 1)] = 0 #if the vector have any selection of the deleted trash, the selection will be changed by 0 so theres nothing to select
-    sel[(sel > array_position + 1)] -= 1 #if the vector have any selection of a trash ordered in the vector in a position after the deleted trash, the selection is
-    #changed to -1 because the deleted trash will affect all the positions after it but not the ones before it
-    #EX: the trash deleted is the 6th position in objectives so 7 in sel vector and current sel vector is [6 8 8 7 8 8 8 8 8 8 8] so the new sel will be [6 7 7 0 7 7 7 7 7 7 7]
-
-    if freq[0][0] == (array_position+1): #freq[0][0] have the current tentative selection (the most common until the 10 iteration)
-        s = 0 #If the most common is the one currently being deleted then the counter of selection will set to 0 so it restarts the selection
-    elif freq[0][0] > (array_position+1): 
-        freq = Counter(sel[0][0:9]).most_common(1) #If the most common is one position after the one being deleted then, the most common one is calculated again with the updated sel vector
-    #If the most common is a position before the one being deleted nothing needs to be done because its position won't change
-
-    for trash in active_trash: #Iterates all the trash in the screen
-        if trash.array_position > array_position: #Checks if the position in the vector, each trash have stored, is located after the one being deleted
-            trash.array_position -= 1 #Updates the trash position with its new location in the objectives vector
-
-#Detects the robots position and orientation, arm is recieved only for plotting purposes in case of an ERROR
-def detecting(depth, arm):
-    global robots #Objects of each robot
-    global firstLoop #Indicates if is the first loop of the game after starting or restarting
-    global screen_robots #Sprite group with the robots screen position
-    global all_sprites #Layered sprite group with all the sprites to be blitted
-    global score #Saves the score points
-    global score_text #Sprite with the number to blit with the points
-
-    kernel = morp.disk(14) #Defines the size of the disk use for the equalization
-    img_local = rank.equalize(depth, selem=kernel) #Equalize the image
-    img_mean = filters.uniform_filter(img_local, size=3) #Applies local mean filter to make smaller the undesired areas
-    toZoom = img_mean.copy() #Copy the image to then be able to cut only the epuck position from the image and fin it's orientation
+#Deletes the trash from the objectives when it disappears, recieve the number of the trash in the objectives
+def remove_trash_position(target_id):
+    trash = targets.owner(target_id)
+    occupancy.remove(trash.cells) #The place of the trash is free again
+    timers.cancel(trash.timer) #The trash won't decompose any more
+    trash.timer = None
+    targets.remove(target_id) #The last objective takes its place, the numbers of the other objectives don't change
+    voter.remove(target_id) #The votes of the trash stop counting, the votes of the other objectives don't change because they use their number and not their position
+    #If the trash was being selected the selection restarts
+
+#Finds the robots in the table without the arm with thresholds proportional to the table, returns the mask of the robots, the mask with their tails and the objects labeled
+def thresholding(depth):
+    img_local = equalizer.run(depth, out=preprocess.equalized) #Equalize the image
+    toZoom = filters.uniform_filter(img_local, size=3, output=preprocess.smoothed) #Applies local mean filter to make smaller the undesired areas, it is kept to then be able to cut only the epuck position from the image and fin it's orientation
     
     #Threshold the image with a value porportional to the tables average for the first time
-    img_mean[(img_mean <= np.mean(depth[(depth > 0) & (depth < 2000)])/2.55)]= 255
-    img_mean[(img_mean > np.mean(depth[(depth > 0) & (depth < 2000)])/2.55)]= 0
+    img_mean = np.less_equal(toZoom, preprocess.mean_between(depth, 0, 2000)/2.55, out=preprocess.robots) #True where the robots are
 
     # #Uncomment to plot images
     # pl.figure(figsize=(18,10))
@@ -450,42 +437,25 @@ def detecting(depth, arm):
     # pl.show()
     # raw_input("Press Enter to terminate.")
     
-    labels_bin, nbr_objects = measurements.label(img_mean) #Method to obtain the number of objects detected and the labels where each object is located
-    regions = regionprops(labels_bin) #Allows to extract area, centroid and orientation
+    regions = labeler.label(img_mean, out=preprocess.labels) #Labels each object detected and extracts their area, centroid and orientation
+    area = regions.largest() #Variable to store the biggest area
 
-    area = 0 #Variable to store the biggest area
-    for props in regions:
-        if props.area > area:
-            area = props.area
-
-    img_mean = toZoom.copy() #Copy the image before being thresholded
     threshold = (31680/area)+402 #New threshold depending if the biggest area detected was to small or to big
 
-    #The image is thresholded again with the new threshold
-    img_mean[(img_mean <= threshold)]= 255
-    img_mean[(img_mean > threshold)]= 0
+    #The image before being thresholded is thresholded again with the new threshold
+    img_mean = np.less_equal(toZoom, threshold, out=preprocess.robots)
 
-    labels_bin, nbr_objects = measurements.label(img_mean) #Method to obtain the number of objects detected and the labels where each object is located
-    regions = regionprops(labels_bin) #Allows to extract area, centroid and orientation
+    regions = labeler.label(img_mean, out=preprocess.labels) #Labels each object detected and extracts their area, centroid and orientation
 
     #Image with a bigger threshold to have the e-pucks tail and find the orientation
-    toZoom[(toZoom <= threshold+65)]= 0
-    toZoom[(toZoom > threshold+65)]= 255
+    tails = np.less_equal(toZoom, threshold+65, out=preprocess.tails)
 
-    area = 0 #Variable to store the biggest area of the new threshold
-    for props in regions:
-        if props.area > area:
-            area = props.area
+    area = regions.largest() #Variable to store the biggest area of the new threshold
 
     ite = (np.rint(area/35)).astype(int) #Define the number of iterations to delete small areas proportionally to the biggest area detected
-    #Thresholded image values are inverted 0->255 and 255->0 to correctly delete the small areas
-    img_mean = img_mean/255
-    img_mean[(img_mean == 0)]= 255
-    img_mean[(img_mean == 1)]= 0
     real = deleting(img_mean, ite) #Method to delete the small areas
 
-    labels_bin, nbr_objects = measurements.label(real) #Method to obtain the number of objects detected and the labels where each object is located
-    regions = regionprops(labels_bin) #Allows to extract area, centroid and orientation
+    regions = labeler.label(real) #Labels each object detected and extracts their area, centroid and orientation
 
     # #Uncomment to plot images
     # pl.figure(figsize=(18,10))
@@ -504,151 +474,167 @@ def detecting(depth, arm):
     # pl.show()
     # raw_input("Press Enter to terminate.")
 
-    area = 0 #Variable to store the biggest area of the new image with less undesired areas
-    for props in regions:
-        if props.area > area:
-            area = props.area
+    return real, tails, regions
+
+#Detects the robots position and orientation, arm is the table with the arm used to learn the empty table
+def detecting(depth, arm):
+    global robots #Objects of each robot
+    global poses #Filtered pose of each robot
+    global firstLoop #Indicates if is the first loop of the game after starting or restarting
+    global screen_robots #Sprite group with the robots screen position
+    global all_sprites #Layered sprite group with all the sprites to be blitted
+    global score #Saves the score points
+    global score_text #Sprite with the number to blit with the points
+
+    now = ti.time() #Time of the frame for the robots poses
+    for pose in poses:
+        pose.predict(now) #Poses of the robots in this frame before detecting them
+    seen = [] #Robots detected in this frame
+
+    #The first loop, while the empty table is learned, when a robot was lost and periodically the whole table is processed, the rest of the frames only the windows around the robots predicted positions
+    scan = not table_model.ready() or windows.full_scan(firstLoop or not all(pose.initialized() for pose in poses))
+
+    if not scan:
+        real, tails = table_model.segment(arm, windows.locate([pose.position() for pose in poses], arm.shape)) #Only the windows of the masks are updated
+        real = morphology.binary_opening(windows.gather(real),np.ones((2,2)),iterations=1) #The windows side by side without isolated pixels of noise
+        regions = labeler.label(real, out=windows.buffers.labels) #Labels each object detected in the windows
+    elif table_model.ready():
+        #Once the empty table is known the robots are the pixels higher than it and the arm the ones higher than a robot, so only one subtraction is needed
+        real, tails = table_model.segment(arm)
+        real = morphology.binary_opening(real,np.ones((2,2)),iterations=1) #Deletes isolated pixels of noise
+        regions = labeler.label(real, out=preprocess.labels) #Labels each object detected and extracts their area, centroid and orientation
+    else:
+        real, tails, regions = thresholding(depth) #While the empty table is learned the robots are found with thresholds proportional to the table
+
+    area = regions.largest() #Variable to store the biggest area of the new image with less undesired areas
 
     lim = (np.rint(area*6/10)).astype(int) #Calculates de 60% of the biggest area detected
+    real, regions = regions.keep(regions.area > lim, out=real) #If the detected area is less than the 60% of the biggest area is deleted, only the robots are left
+    offsets = np.zeros((len(regions), 2)) #Row and column added to the centers of the objects to have them in the table coordinates
+    if not scan:
+        real, regions, offsets = windows.place(regions, out=real) #Only the objects near the predicted position of their window are kept
+    centers = regions.centroid + offsets #Row and column of the center of each object in the table
     
     k = 0 #Counter that defines the robot position from 0 to 3
-    coors = np.zeros((2,4)) #Vector that stores the robots positions
+    coors = np.zeros((2,len(robots))) #Vector that stores the robots positions
+
+    #After the first loop all the objects are matched at once with the robots predicted positions, so two objects can't be the same robot
+    owners = -np.ones(len(regions), dtype = int) #Robot of each object, -1 if the object is not a robot like a hand or an other object
+    if not firstLoop:
+        tracked = [i for i in range(len(poses)) if poses[i].initialized()] #Only the robots already found have a position to match
+        matches, others, missing = assign([poses[i].position() for i in tracked], centers)
+        for region, index in matches:
+            owners[region] = tracked[index]
 
     #Each loop the robots sprites are created
     all_sprites.remove(screen_robots.sprites())
     screen_robots.empty()
 
-    for props in regions: 
-        #If the detected area is less than the 60% of the biggest area is deleted
-        if props.area <= lim: 
-            for coord in props.coords:
-                real[coord[0], coord[1]] = 0
-        else:
-            #Cuts an square where the robot is to find its orientation
-            test = toZoom[props.centroid[0] - 12:props.centroid[0] + 12,props.centroid[1] - 12:props.centroid[1] + 12]
-            
-            test = 1*(test <128) 
+    #Cuts an square where each robot is and finds its orientation from the biggest area, so the small undesired areas are ignored
+    #POSSIBLE ERROR with 1 iteration of the opening the e-puck's tail is too small and with 0 can be joined to a small area nex to him
+    headings, squares, clipped = orientation.run(tails, centers) #clipped tells if the square of each object goes beyond the table
 
-            #POSSIBLE ERROR with 1 iteration the e-puck's tail is too small and with 0 can be joined to a small area nex to him
-            test = morphology.binary_opening(test,np.ones((2,2)),iterations=1)
+    # #Uncomment to plot images
+    # pl.figure(figsize=(17,10))
+    # pl.subplot(1,2,1)
+    # pl.imshow(toZoom)
+    # pl.colorbar()
+    # pl.subplot(1,2,2)
+    # pl.imshow(np.vstack(squares))
+    # pl.colorbar()
+    # pl.show()
+    # raw_input("Press Enter to terminate.")
+
+    for region in range(len(regions)):
+        if not firstLoop and owners[region] < 0:
+            continue #Objects that are not a robot are ignored
+
+        centroid = centers[region] #Row and column of the center of the object in the table
+        ori = headings[region] #Orientation of the robot
+        test = squares[region] #Square used to find the orientation, only for plotting purposes
+
+        #More objects than robots can be detected if something is at the same height of the robots like a han or other object
+        if k >= len(robots):
+            print 'More than ' + str(len(robots)) + ' detected :('
+            break #If theres an extra object detected it will be ignored
+
+        if clipped[region]: #The robot is too close to the edge, part of the square around it is outside the table
+            robots[k if firstLoop else owners[region]].set_motors_speed(0,0) #Only that robot is stopped so it doesn't fall
+
+        loc = np.array([[centroid[0]],[centroid[1]]]) #Stores current robot position
+        asign = loc.copy() #A copy is made so the robots position doesn't change the next time a robot's position is asigned to loc
+
+        if firstLoop: #Run only the first loop after the game started
+            poses[k].initialize(centroid, np.rad2deg(ori), now) #Starts the filter of the robot in its base
+            seen.append(k)
+            robots[k].set_initialPos(asign) #Save the robots base position
+            robots[k].set_coors(asign[:,0]) #Save the robots actual position in this case is the same
+            robots[k].set_orientation(np.rad2deg(ori)) #Saves robot's orientation
+            robots[k].set_test(test) #This is only for plotting purposes to see if the angle is right in case of necessary
+            robots[k].set_cleaner_type(k) #Robots vector position also defines the type of trash he will clean 0=Paper, 1=Aluminium, 2=Plastic and 3=Glass
+            robot_sprite = ScreenRobot(centroid[0], centroid[1], k) #Creates the sprite that will move with the robot
+            robot_base = ScreenRobot(centroid[0], centroid[1], 4) #Creates the sprite that will stay in the base to avoid trash being positioned there
+        else:
+            index = owners[region] #Robot matched with the object, they are in the same order first created 2486->0, 3047->1, 3067->2 and 3078->3
+
+            #The detection corrects the filter of the robot, if it is too far from the prediction its ignored and the predicted pose is used
+            if poses[index].update(centroid, np.rad2deg(ori)):
+                seen.append(index)
+            centroid = poses[index].position() #Filtered position
+
+            if robots[index].get_returning(): #This checks if the robot is currently coming back from his objective
+                trash = assignments.trash_of(index) #Trash that is asigned to the robot
+                if trash is not None:
+                    #Calculates the distance between the trash and the previous robot position already multiplied by relocate to have everything in screen coordinates
+                    dif_x = trash.rect.x - robots[index].get_coors()[0]*relocate
+                    dif_y = trash.rect.y - robots[index].get_coors()[1]*relocate
+                    #Move the trash to a location separated from the new robot position exactly the same distance calculated before so the trash looks like its being pulled by the robot
+                    trash.rect.x = centroid[0]*relocate + dif_x
+                    trash.rect.y = centroid[1]*relocate + dif_y
+
+            elif robots[index].get_arrived(): #Checks if the robot arrived to its base
+                trash = assignments.release_robot(index) #The robot is not in charge of its trash any more
+                if trash is not None: #Checks if the robot arrived with a trash
+                    score += 1 #Add a point to the score
+                    point_sound.play(loops = 0) #Plays the scoring sound, loops indicates how many times the sound is going to be repeated 0 means no repetition only played once
+                    score_text.update_counter(score, BLUE) #Update the score text to be displayed in the screen
+                    active_trash.remove(trash) #Removes the trash of the screen trash
+                    all_sprites.remove(trash) #Removes the trash from the all active sprites to be blitted so it disappears from the screen
+                    remove_trash_position(trash.target_id) #Removes the trash position from the objectives vector and update any current selection is being made
+                    trash.decomposing = 0 #Sets the trash decomposition to 0 again in case of being displayed again
+                    inactive_trash.add(trash) #Add the trash to inactive so it can be randomly picked in the available trash
+
+                robots[index].set_arrived(False) #Arrived is set to False when the robot have finish all his trajectory and points are updated in case its needed
+
+            robots[index].set_coors(centroid) #The robot save its new position
+            robots[index].set_orientation(poses[index].heading()) #The robot save its new orientation
+            robots[index].set_test(test) #This is only for plotting purposes to see if the angle is right in case of necessary
+            robot_sprite = ScreenRobot(centroid[0], centroid[1], index) #Creates the sprite that will move with the robot
             
-            # #Uncomment to plot images
-            # pl.figure(figsize=(17,10))
-            # pl.subplot(1,2,1)
-            # pl.imshow(toZoom)
-            # pl.colorbar()
-            # pl.subplot(1,2,2)
-            # pl.imshow(test)
-            # pl.colorbar()
-            # pl.show()
-            # raw_input("Press Enter to terminate.")
-
-            labels, nb = measurements.label(test) #Method to obtain the number of objects detected and the labels where each object is located
-
-            try:
-                closeUps = regionprops(labels) #Allows to extract area, centroid and orientation
-            except Exception, e:
-                print 'ROBOT IN RISK!!!!!!!!' #Robot it's too close to the edge so it couldn't be cut out when creating test
-                print props.centroid[0], props.centroid[1]
-                for robot in robots:
-                    robot.set_motors_speed(0,0) #Stop the robots so they don't fall
-                
-                pl.figure(figsize=(15,10))
-                pl.subplot(1,6,1)
-                pl.imshow(arm, vmin = 1700, vmax = 1900)
-                pl.colorbar()
-                pl.subplot(1,6,2)
-                pl.imshow(toZoom)
-                pl.colorbar()
-                pl.subplot(1,6,3)
-                pl.imshow(img_local)
-                pl.colorbar()
-                pl.subplot(1,6,4)
-                pl.imshow(img_mean)
-                pl.colorbar()
-                pl.subplot(1,6,5)
-                pl.imshow(real)
-                pl.colorbar()
-                pl.subplot(1,6,6)
-                pl.imshow(test)
-                pl.colorbar()
-                pl.show()
-                raw_input("Press Enter to terminate.")
-
-            ori = 0 #Variable to store the orientation of the robot
-            ar = 0 #Variable to store the biggest area so the small undesired areas are ignored
-            for closeUp in closeUps:
-                if closeUp.area > ar:
-                    ar = closeUp.area
-                    ori = closeUp.orientation
-
-            #More than 4 can be detected if something is at the same height of the robots like a han or other object
-            if k >= 4:
-                print 'More than 4 detected :('
-                break #If theres an extra object detected it will be ignored
-
-            loc = np.array([[props.centroid[0]],[props.centroid[1]]]) #Stores current robot position
-            asign = loc.copy() #A copy is made so the robots position doesn't change the next time a robot's position is asigned to loc
-
-            if firstLoop: #Run only the first loop after the game started
-                robots[k].set_initialPos(asign) #Save the robots base position
-                robots[k].set_coors(asign[:,0]) #Save the robots actual position in this case is the same
-                robots[k].set_orientation(np.rad2deg(ori)) #Saves robot's orientation
-                robots[k].set_test(test) #This is only for plotting purposes to see if the angle is right in case of necessary
-                robots[k].set_cleaner_type(k) #Robots vector position also defines the type of trash he will clean 0=Paper, 1=Aluminium, 2=Plastic and 3=Glass
-                robot_sprite = ScreenRobot(props.centroid[0], props.centroid[1], k) #Creates the sprite that will move with the robot
-                robot_base = ScreenRobot(props.centroid[0], props.centroid[1], 4) #Creates the sprite that will stay in the base to avoid trash being positioned there
-            else:
-                for i in range(0,len(robots)):
-                    coors[:,i] = robots[i].get_coors() #If is not the first loop the previous robots positions are extracted they will be in the same order first created 2486->0, 3047->1, 3067->2 and 3078->3
-
-                distance = np.sqrt((props.centroid[0] - coors[0,0:4])**2 + (props.centroid[1] - coors[1,0:4])**2) #Calculates the distance between the actual position of a robot to the previous position of the 4 robots
-                index = np.argmin(distance) #Extracts the position of the minimum distance (from 0 to 3 indicating the same robot position in Robots[]) indicating thats the robot currently being detected
-
-                if robots[index].get_returning(): #This checks if the robot is currently coming back from his objective
-                    for trash in active_trash: #Iterates all the trashes in the screen
-                        if trash.cleaner_id == index: #Checks if there's a trash that is asigned to the robot
-                            #Calculates the distance between the trash and the previous robot position already multiplied by relocate to have everything in screen coordinates
-                            dif_x = trash.rect.x - robots[index].get_coors()[0]*relocate
-                            dif_y = trash.rect.y - robots[index].get_coors()[1]*relocate
-                            #Move the trash to a location separated from the new robot position exactly the same distance calculated before so the trash looks like its being pulled by the robot
-                            trash.rect.x = props.centroid[0]*relocate + dif_x
-                            trash.rect.y = props.centroid[1]*relocate + dif_y
-                            break #One robot can only have asigned one trash so its not necessary to finish the FOR loop
-
-                elif robots[index].get_arrived(): #Checks if the robot arrived to its base
-                    for trash in active_trash: #Iterates all the trashes in the screen
-                        if trash.cleaner_id == index: #Checks if the robot arrived with a trash
-                            score += 1 #Add a point to the score
-                            point_sound.play(loops = 0) #Plays the scoring sound, loops indicates how many times the sound is going to be repeated 0 means no repetition only played once
-                            score_text.update_counter(score, BLUE) #Update the score text to be displayed in the screen
-                            active_trash.remove(trash) #Removes the trash of the screen trash
-                            all_sprites.remove(trash) #Removes the trash from the all active sprites to be blitted so it disappears from the screen
-                            remove_trash_position(trash.array_position) #Removes the trash position from the objectives vector and update any current selection is being made
-                            trash.cleaner_id = None #Deletes the previous robot ID
-                            trash.decomposing = 0 #Sets the trash decomposition to 0 again in case of being displayed again
-                            inactive_trash.add(trash) #Add the trash to inactive so it can be randomly picked in the available trash
-                            break #One robot can only have asigned one trash so its not necessary to finish the FOR loop
-
-                    robots[index].set_arrived(False) #Arrived is set to False when the robot have finish all his trajectory and points are updated in case its needed
-
-                robots[index].set_coors(asign[:,0]) #The robot save its new position
-                robots[index].set_orientation(np.rad2deg(ori)) #The robot save its new orientation
-                robots[index].set_test(test) #This is only for plotting purposes to see if the angle is right in case of necessary
-                robot_sprite = ScreenRobot(props.centroid[0], props.centroid[1], index) #Creates the sprite that will move with the robot
-                
-            k += 1 #Updates the robot counter (from 0 to 3)
+        k += 1 #Updates the robot counter (from 0 to 3)
 
     firstLoop = False #It have to be changed outside of the for loop because for each robot it have to enter to the firstloop case
 
+    #The robots not detected, like when an arm is hiding them, keep moving with their predicted pose so they don't lose the track
+    for i in range(0,len(robots)):
+        if i not in seen and poses[i].initialized():
+            poses[i].miss()
+            robots[i].set_coors(poses[i].position())
+            robots[i].set_orientation(poses[i].heading())
+
     for i in range(0,len(robots)):
         coors[:,i] = robots[i].get_coors() #creates a vector with the robots position in order (from 0 to 3)
 
-    labels_bin, nbr_objects = measurements.label(real) #Method to obtain the number of objects detected and the labels where each object is located
+    nbr_objects = len(regions) #Objects left after deleting the small areas
+    windows.lost = len(seen) < len(robots) #If a robot wasn't found the next frame the whole table is processed
+
+    #The pixels of the table without robots or the arm are learned as the empty table, only when the whole table was processed
+    if scan:
+        table_model.learn(arm, real, table_model.arm if table_model.ready() else arm <= floor.robots[0])
 
-    #Less than 4 objects can be detected in case an arm its hiding the robot from the kinect
-    if nbr_objects != 4: 
-        print '!!!!!!!!!!!!!!Less than 4!!!!!!!!!!!!!' #Printed in the command line just for debugging purposes
+    #Less objects than robots can be detected in case an arm its hiding the robot from the kinect
+    if nbr_objects != len(robots): 
+        print '!!!!!!!!!!!!!!Less than ' + str(len(robots)) + '!!!!!!!!!!!!!' #Printed in the command line just for debugging purposes
         
         # #Uncomment to plot images
         # pl.figure(figsize=(15,10))
@@ -690,30 +676,25 @@ def updating_selection(radius, x, y, color):
     selection_sprite = Selection(radius, x-radius, y-radius, color) #The coordinates need to be moved to the corner of the bounding box thats why its necessary to substract the radius
     selection_sprite.image.set_alpha(80) #This alpha value set the transparency of the pointer so the circle let the user see what is being slected behind
 
-#This method allows to know the position in the objectives vector of the selected object by the user
-def selecting(im, zones, floor):
-    global s #Selection counter
-    global sel #Vector to store the sequence of selections to fin the most common
-    global freq #Stores the value of the most frequent selection in the first 10 selections, in case there is a mistake due to the 
-    #3D pointing vector uncertainty showing no selection, if the correct selections of an objective is at least 7 from 10 the tentative selection is made
+#This method allows to know the position in the objectives vector of the selected object by the user, floor has the heights of the game
+#ids has the number of each objective in the selection, if it is not given the objectives are numbered by their position starting in 1 like the menu buttons
+def selecting(im, zones, floor, ids = None):
     global objective #Stores the position of the trash that was selected
-    global freq2 #Stores the value of the most frequent selection in the 22 selections
     global cleaners #Save the current robot selected or pause button
-    
-    if s is None: 
-        s = 0 #If the selection counter hasn't started then its initialized in 0
-        sel = np.zeros((1,23)) #Sel will store all the sequence of selections to check if the selection is valid or the user change of selection
-    elif (s == 0):
-        sel = np.zeros((1,23)) #If the selection has been restarted the selection vector is emptied
-
-    highArm = floor/2.27 #Threshold proportional to the floor average to find the highest part of the arm, a smaller value means its closer to the kinect so its higher
-    lowArm = floor/1.48 #Threshold proportional to the floor average to find the lowest part of the arm, a bigger value means its closer to the floor so its lower
-    hand = np.where((im >= highArm) & (im < lowArm)) #Variable that stores only the indexes of the values between that threshold
+
+    if ids is None:
+        ids = np.arange(1, len(zones[0]) + 1)
+
+    #Thresholds proportional to the floor average to find the highest part of the arm (a smaller value means its closer to the kinect so its higher)
+    #and the lowest part of the arm (a bigger value means its closer to the floor so its lower)
+    highArm, lowArm = floor.arm
+    armBand = preprocess.between(im, highArm, lowArm) #Pixels between that threshold, the image of the arm is not modified
+    hand = np.nonzero(armBand) #Variable that stores only the indexes of the values between that threshold
     
     if hand[0].any(): #Check if there is any value to see if there is an arm to analyze
         #Converts the depth values in mm to px, first the values of the arm are substracted from the lowest position posible (meaning the biggest depth value) to locate the depth 0 at the lowest point of the arm, 
         #the closest one to the robot. Then that mm value its multiplied for the reason between the width of the table in pixels and mm, each -3 is substracted due to 3 extra columns of pixels taken in each side of the table when cutting it
-        han = (lowArm-(im[(im >= highArm) & (im < lowArm)]))*((len(im[0])-3-3)/tableWidth)
+        han = (lowArm-(im[armBand]))*((len(im[0])-3-3)/tableWidth)
         
         # #Uncomment to plot image
         # pl.figure(figsize=(15,10))
@@ -722,37 +703,24 @@ def selecting(im, zones, floor):
         # pl.show()
         # raw_input("Press Enter to terminate.")
     
-        #The image is thresholded so only the arm is left in the image
-        im[((im < highArm) | (im >= lowArm))] = 0
-        im[((im >= highArm) & (im < lowArm))] = 255
-        labels_c, objects_c = measurements.label(im) #Method to obtain the number of objects detected and the labels where each object is located
-        handc = regionprops(labels_c) #Allows to extract area, centroid and orientation
-        ang = handc[0].orientation + constants.pi/2  #hand angle referenced to Y axis
+        #Only the arm is labeled
+        handc = labeler.label(armBand, out=preprocess.labels) #Labels each object detected and extracts their area, centroid and orientation
+        ang = handc.orientation[0] + constants.pi/2  #hand angle referenced to Y axis
         
-        #Dictionary with the coordinates of the arm in pixels
-        data = {'x': hand[0], 
-            'y': hand[1], 
-            'z': han}
-        df = pd.DataFrame(data) #panda library organizes the data 
-
         slope = np.tan(ang) #slope of the 2D line of the arm
-        intercept = ((handc[0].centroid)[1] - (np.tan(ang)*(handc[0].centroid)[0])) #intercepth of the 2D line of the arm using the angle and the centroid coordinates
+        intercept = (handc.centroid[0][1] - (np.tan(ang)*handc.centroid[0][0])) #intercepth of the 2D line of the arm using the angle and the centroid coordinates
 
         # #Uncomment to plot image of the 2D arm and the line created
         # y2 = hand[0]*slope + intercept 
         # pl.subplot(1,3,1)
-        # pl.scatter((handc[0].centroid)[0],(handc[0].centroid)[1])
+        # pl.scatter(handc.centroid[0][0],handc.centroid[0][1])
         # pl.subplot(1,3,2)
         # pl.scatter(hand[0],hand[1])
         # pl.subplot(1,3,3)
         # pl.plot(hand[0],y2)
         # pl.show()
 
-        lm = smf.ols(formula = 'z ~ x + y', data = df).fit() #Stats model calculate the linear regression model in 3D
-        #Parameters extracted from the model 0 = Intercept, 1 = A*(x), 2 = B*(y) 
-        A = lm.params[1]
-        B = lm.params[2]
-        C = lm.params[0]
+        A, B, C = plane.fit(hand[0], hand[1], han) #Robust linear regression of the arm in 3D with the coordinates of the arm in pixels, z = A*x + B*y + C
 
         #Uncomment to plot image of the 3D arm and the 3D line created
         # y2 = hand[0]*slope + intercept 
@@ -781,8 +749,9 @@ def selecting(im, zones, floor):
         # raw_input("Press Enter to terminate.")
 
         #Putting the 2 models together and defining Z = 0 we can find the X,Y coordinates the user is pointing
-        y0 = (A*intercept - C*slope)/(A + B*slope)
-        x0 = (y0 - intercept)/slope
+        x0, y0 = intersection(A, B, C, slope, intercept)
+        if np.isfinite(x0) & np.isfinite(y0): #An arm parallel to the table doesn't point anywhere and its point is not filtered
+            x0, y0 = pointer.filter((x0, y0), ti.time()) #The pointer doesn't shake and its votes don't jump between close objectives
         distance = np.sqrt((zones[0] - x0)**2 + (zones[1] - y0)**2) #Calculates the distance between the X,Y pointed and all the objectives
         minimum = np.min(distance) #Finds the closes objective to this coordinates
        
@@ -793,174 +762,146 @@ def selecting(im, zones, floor):
         else:
             gr = 0 # 0 when is nothing selected because the pointer is too far from any objective
 
-        if s < 10:
-            #When the user starts pointing the 10 first loops the size of the selector will be smaller (Radius = 27)
-            updating_selection(27,(np.rint(x0*relocate)).astype(int),(np.rint(y0*relocate)).astype(int), RED) #The coordinates sent can't be decimal and they need to be relocated to screen coordinate system
+        target = ids[gr-1] if gr != 0 else 0 #Number of the objective pointed, it doesn't change when other objectives disappear
 
-        sel[0][s] = gr #The actual selection is added to the selection vector
-
-        if s == 10: #Checks if the selection loop is the 11th
-            freq = Counter(sel[0][0:9]).most_common(1) #Finds which is the most common number and how many times have been repeated
-            if freq[0][0] != 0: #Checks if the most repeated value is not zero
-                if freq[0][0] == freq2[0][0]: 
-                    s = 0 #if the objective inmediatly selected before was the same no need to continue because is already selected
-                    print 'RE-SELECTING', freq[0][0]
-                else: 
-                    if freq[0][1] < 7:
-                        s = 0 #If the most common selection hasn't been at least selected 7 times the selection is restarted
-                        print 'THE SELECTION IS NOT SUFFICIENT < 7'
-                    else:
-                        print 'PRE-SELECTION', freq[0][0]
-                        s = s + 1 #If the selection has been repeated at least 7 times then an objective starts being selected and the selection pointer is bigger (radius s*3)
-                        updating_selection(s*3,(zones[0][freq[0][0]-1]*relocate).astype(int),(zones[1][freq[0][0]-1]*relocate).astype(int), RED)
-            else:
-                s = 0 #If the most common is 0 the selection restarts
-                print 'THERE IS NO SELECTION THE COUNTER IS RESETED'
-        else:
+        if voter.candidate is None:
+            #When the user starts pointing and there is no pre-selection the size of the selector will be smaller (Radius = 27)
+            updating_selection(27,(np.rint(x0*relocate)).astype(int),(np.rint(y0*relocate)).astype(int), RED) #The coordinates sent can't be decimal and they need to be relocated to screen coordinate system
 
-            if s == 22:
-                s = 0 #If selection counter reach 22 the selection will be restarted no matter a definitive selection is made or not
-                freq2 = Counter(sel[0]).most_common(1) #Finds which is the most common number and how many times have been repeated
-                if freq2[0][0] == freq[0][0]: #If the most common number is the same that was pre-selected then the selection is correct and continues
-                    
-                    if freq2[0][1] >= 16: #If the most common has at least being correctly selected 16 times from 22 the selection is correct and can continue
-                        if freq[0][0] <= 5: #If the selection is less or equal than 5 then its a robot or the pause button
-                            if (cleaners != 0) & (cleaners != 5): #If there is a new selection and the cleaners is not 0 (no objective) or 5 (pause button) 
-                            #that means a robot was selected and not assigned and now the selection is being changed
-                                for i in range(8):
-                                    robots[(cleaners-1).astype(int)].set_led(i,0) # i goes from 0 to 7 to address all the leds and 0 to turn off the e-puck selected before
-                            
-                            print freq2[0][0], 'GROUP SELECTED!!!!!!!!!!!!!!!!!!!!'
-                            cleaners = freq2[0][0] #The position of the new selected robot is stored
-                            #This selecting method is called also in the start or pause menus so in case its pause 
-                            #cleaners will be 5 or in case its start or game over menu, the length of the objectives are the buttons so the maximum is 3
-                            if (len(zones[0]) >= 5) & (cleaners != 5):
-                                for i in range(8): #If its not in a menu then the selected robot turn on his leds
-                                    robots[(cleaners-1).astype(int)].set_led(i,1) # i goes from 0 to 7 to address all the leds and 0 to turn off the e-puck selected before
-                        else:
-                            #If the selection is more than 5 its a trash the one being selected
-                            print freq2[0][0], 'OBJECTIVE SELECTED!!!!!!!!!!!!!!!!!!!!'
-                            objective = freq2[0][0] #The position of the trash is stored
-                        
-                        #The selection is succesful so the objective is selected and the selection pointer is bigger (Radius=75) and green
-                        updating_selection(75,(zones[0][freq[0][0]-1]*relocate).astype(int),(zones[1][freq[0][0]-1]*relocate).astype(int), GREEN)
-                    else:
-                        #If the selection doesn't have at least 16 repetitions then the selection is not efective the user didn't keep his selection constant
-                        print 'ERROR: SELECTION NOT CONSTANT' 
-                        freq2 = np.zeros((1,2)) #freq2 is reseted so when checking if its RE-SELECTING doesn't think he is because the selection wasn't effective
-                else:
-                    #If the selection is not the same as the one pre-selected then the user change of selection
-                    print 'ERROR: DIFFERENT SELECTION'
-                    freq2 = np.zeros((1,2))#freq2 is reseted so when checking if its RE-SELECTING doesn't think he is because the selection wasn't effective
+        result = voter.vote(target) #The actual selection is added to the votes
+
+        if (result == voter.PRESELECTED) | ((result == voter.VOTING) & (voter.candidate is not None)):
+            #The most common of the votes is pre-selected and the pointer is fixed to it until the selection is effective or not
+            #the size of the pointer is proportional to the actual number of votes (radius = votes*3)
+            candidate = 1 + np.flatnonzero(ids == voter.candidate)[0] #Position of the pre-selected objective starting in 1
+            if result == voter.PRESELECTED:
+                print 'PRE-SELECTION', candidate
+            updating_selection(len(voter)*3,(zones[0][candidate-1]*relocate).astype(int),(zones[1][candidate-1]*relocate).astype(int), RED)
+        elif result == voter.SELECTED:
+            #The pre-selected objective has enough votes so the selection is correct and can continue
+            selected = 1 + np.flatnonzero(ids == voter.selected)[0] #Position of the selected objective starting in 1
+            if selected <= 5: #If the selection is less or equal than 5 then its a robot or the pause button
+                if (cleaners != 0) & (cleaners != 5): #If there is a new selection and the cleaners is not 0 (no objective) or 5 (pause button) 
+                #that means a robot was selected and not assigned and now the selection is being changed
+                    for i in range(8):
+                        robots[(cleaners-1).astype(int)].set_led(i,0) # i goes from 0 to 7 to address all the leds and 0 to turn off the e-puck selected before
+
+                print selected, 'GROUP SELECTED!!!!!!!!!!!!!!!!!!!!'
+                cleaners = selected #The position of the new selected robot is stored
+                #This selecting method is called also in the start or pause menus so in case its pause 
+                #cleaners will be 5 or in case its start or game over menu, the length of the objectives are the buttons so the maximum is 3
+                if (len(zones[0]) >= 5) & (cleaners != 5):
+                    for i in range(8): #If its not in a menu then the selected robot turn on his leds
+                        robots[(cleaners-1).astype(int)].set_led(i,1) # i goes from 0 to 7 to address all the leds and 0 to turn off the e-puck selected before
             else:
-                if s > 10:
-                    #If the selection counter is greater than 10 it means an objective have been pre-selected so the selection is fixed to this objective until the selection is effective or not (s=22)
-                    #the size of the pointer is proportional to the actual number of selections (radius = s*3)
-                    updating_selection(s*3,(zones[0][freq[0][0]-1]*relocate).astype(int),(zones[1][freq[0][0]-1]*relocate).astype(int), RED)
-                    
-                s = s + 1 #Each loop if the counter is not 22 the counter is increased
+                #If the selection is more than 5 its a trash the one being selected
+                print selected, 'OBJECTIVE SELECTED!!!!!!!!!!!!!!!!!!!!'
+                objective = voter.selected #The number of the trash is stored, it is still valid if other trash disappears before the robot is assigned
+
+            #The selection is succesful so the objective is selected and the selection pointer is bigger (Radius=75) and green
+            updating_selection(75,(zones[0][selected-1]*relocate).astype(int),(zones[1][selected-1]*relocate).astype(int), GREEN)
+        elif result == voter.RESELECTING:
+            print 'RE-SELECTING', 1 + np.flatnonzero(ids == voter.selected)[0] #The objective inmediatly selected before was the same so no need to continue because is already selected
+        elif result == voter.INSUFFICIENT:
+            print 'THE SELECTION IS NOT SUFFICIENT'
+        elif result == voter.NOTHING:
+            print 'THERE IS NO SELECTION THE COUNTER IS RESETED'
+        elif result == voter.NOT_CONSTANT:
+            #The user didn't keep his selection constant, the same objective can be selected again
+            print 'ERROR: SELECTION NOT CONSTANT'
+        elif result == voter.DIFFERENT:
+            #The user change of selection, the same objective can be selected again
+            print 'ERROR: DIFFERENT SELECTION'
 
     else:
         #If there is no arm to analyze the user is not selecting any more or changed its mind so the selection is cleared
         clearing_selection()
-        s = 0 #The selection is restarted
+        voter.reset() #The selection is restarted
+        pointer.reset() #The next pointing starts from its own point
 
     return cleaners #If there is a selection returns the robot position+1 or 0 if there is no selection
 
-#This method allows to put a new trash in the screen correctly
+#This method marks the space of the screen that never changes during a game, the walls, the pause button, the scores and the trash icons of each robot
+def building_occupancy():
+    occupancy.clear()
+    for sprite in walls.sprites() + titles.sprites() + texts.sprites() + types.sprites() + [pause]:
+        occupancy.add(sprite.rect)
+
+#This method puts a new trash in the screen when its time comes and schedules the next one
 def positioning_trash():
-    global appearing_time #Time when the new trash should appear
     global offset_time #Miliseconds between each trash appearance
     global inactive_trash #Sprite group with all the trash sprites that are not in the screen
     global active_trash #All the trash that is in the screen
     global all_sprites #Layered sprite group containig active sprites
-    global newZones #Vector with the positions of the trash in the screen
-
-    relocate_trash = True #Variable to control if a trash was succesfully positioned or not
-
-    running_time = ti.time()*1000 - start_time #Calculates the time game have been running in miliseconds
-
-    if (running_time) >= appearing_time: #Checks if the current running time is greater or equal thant the asigned time for a new trash
-        trash_sprite = random.choice(inactive_trash.sprites()) #A sprite of the inactive trash is randomly selected
-        all_sprites.remove(contaminated_water_1) #The sprite with the conatminated water image is removed because if not there will be always a collition of any trash with this image
-
-        while relocate_trash: 
-            #Randomly ubicates the trash in the screen
-            trash_sprite.rect.x = random.randrange(SCREEN_WIDTH)
-            trash_sprite.rect.y = random.randrange(SCREEN_HEIGHT)
-
-            #This method checks if the given sprite (trash_sprite) collides with any of the active sprites (all_sprites) the third argument is set to True if you want to remove from the group the sprites that collided with given sprite
-            overlapping_list = pygame.sprite.spritecollide(trash_sprite, all_sprites, False)
 
-            if not overlapping_list:
-                relocate_trash = False #The while loop will continue until the trash is position without colliding with anything meaning the overlapping_list is empty
-
-        if newZones is None: 
-            newZones = np.zeros((2,1)) #If the vector with the trash positions hasn't been initialized then its set to zeros
-            #The first trash is stored in the first column, the x+width/2 and y+heigth/2 is to save the center of the trash not the corner of the bounding box
-            newZones[:,0] = np.array([[(trash_sprite.rect.x+trash_sprite.rect.width/2)/relocate],[(trash_sprite.rect.y+trash_sprite.rect.height/2)/relocate]])[:,0]
-            i = 0 #Variable used to indicate the trash wich is its position
-        else:
-            i = len(newZones[0]) #The position of the actual trash will be the length of the vector if there is already 3 trashes (from position 0 to 2) then its position would be the 3rd
-            aux = np.zeros((2,1)) #Auxiliar variable just to concatenate the trash position to the vector
-            #The x+width/2 and y+heigth/2 is to save the center of the trash not the corner of the bounding box
-            aux[:,0] = np.array([[(trash_sprite.rect.x+trash_sprite.rect.width/2)/relocate],[(trash_sprite.rect.y+trash_sprite.rect.height/2)/relocate]])[:,0]
-            newZones = np.concatenate((newZones, aux), axis = 1) #Concatenates the auxiliar vector to the newZones and axis indicates to concatenate as a column
-
-        inactive_trash.remove(trash_sprite) #After succesfully positioning the trash, it is removed from the inactive group so it can't be placed twice
-        trash_sprite.time = ti.time()*1000 #This saves in each trash the time when it was positioned in the screen in miliseconds
-        trash_sprite.array_position = i + 5 #The 5 is added because in the objective vector the trash will always start in the 5th position after the four robots (from 0 to 3) and the pause button (position 4)
-        active_trash.add(trash_sprite) #The trash is added to the active trash
-        all_sprites.add(trash_sprite, layer = trash_sprite.layer) #The trash is added to the sprites that are going to be blitted
-        all_sprites.add(contaminated_water_1, layer = contaminated_water_1.layer) #The contaminated water image is placed back so it can be correctly blitted
-        
-        if offset_time <= 100: #Defines the minimum time between the appearances of trashes
-            offset_time = 100
-        else:
-            #Defines how fast is going to appear next trash, if is greater than the minimum (100 miliseconds) then 0.1 seconds will be substracted in each appeareance, so next trash appear always faster than the before
-            offset_time-=100
+    trash_sprite = random.choice(inactive_trash.sprites()) #A sprite of the inactive trash is randomly selected
+
+    #Randomly ubicates the trash in a free place of the screen, the robots are only there while the place is chosen because they move
+    robots_cells = [occupancy.add(robot.rect) for robot in screen_robots]
+    place = occupancy.sample(trash_sprite.rect.width, trash_sprite.rect.height)
+    for cells in robots_cells:
+        occupancy.remove(cells)
+    if place is None:
+        log('There is no space for a new trash')
+        timers.schedule(offset_time, SPAWN) #It is tried again later, when some trash has been cleaned
+        return
+    trash_sprite.rect.x, trash_sprite.rect.y = place
+    trash_sprite.cells = occupancy.add(trash_sprite.rect) #The place is used until the trash disappears
+
+    #The trash is added to the objectives with the center of the trash not the corner of the bounding box (x+width/2 and y+heigth/2)
+    trash_sprite.target_id = targets.add(((trash_sprite.rect.x+trash_sprite.rect.width/2)/relocate, (trash_sprite.rect.y+trash_sprite.rect.height/2)/relocate), trash_sprite)
+
+    inactive_trash.remove(trash_sprite) #After succesfully positioning the trash, it is removed from the inactive group so it can't be placed twice
+    trash_sprite.timer = timers.schedule(20000, DECOMPOSE, trash_sprite) #The trash contaminates the water 20 seconds after it appears
+    active_trash.add(trash_sprite) #The trash is added to the active trash
+    all_sprites.add(trash_sprite, layer = trash_sprite.layer) #The trash is added to the sprites that are going to be blitted
+    
+    if offset_time <= 100: #Defines the minimum time between the appearances of trashes
+        offset_time = 100
+    else:
+        #Defines how fast is going to appear next trash, if is greater than the minimum (100 miliseconds) then 0.1 seconds will be substracted in each appeareance, so next trash appear always faster than the before
+        offset_time-=100
 
-        appearing_time = running_time + offset_time #Sets the time for positioning a new trash adding the offset time to the time that the game have been running
+    timers.schedule(offset_time, SPAWN) #The next trash appears after the offset time
 
-#This method update the contamination points and the contamination image 
-def updating_contamination():
+#This method decomposes a trash when its time comes, updates the contamination points and the contamination image 
+def updating_contamination(trash):
     global active_trash #Sprites group with the trash in the screen
     global contamination #Contamination points
     global robots #All the robots objects
     global contaminated_water_1 #Sprite with the image of the contaminated water
     global contamination_text #Number of the contamination points
 
-    for trash in active_trash: #Each trash in the screen is checked
-        if (ti.time()*1000 - trash.time) >= 20000: #If the time since the trash was positioned or since it last contaminated the screen is greater or equal to 20 second is time to contaminate again 
-            contamination += 1 #Adds one point of contamination to the contamination points
-            contamination_text.update_counter(contamination, BLUE) #Updates the number to be displayd with the contamination points
-            contaminated_water_1.image.set_alpha(contamination*5) #The factor (*5) defines how fast the water start getting contaminated
-            trash.decomposing += 1 #Updates the decomposing counter of the trash
-            trash.time = ti.time()*1000 #Updates the time of last contamination in miliseconds
-            if trash.decomposing == 4: #Number of contaminations before totally decomposing and disappearing
-                disappear_sound.play(loops = 0) #Plays a sound to indicate the trash was decomposed
-                active_trash.remove(trash) #The trash is removed from the active trash
-                all_sprites.remove(trash) #The trash is removed from the group of sprites to be blitted
-                remove_trash_position(trash.array_position) #Remove the trash position from the trash vector and updates the selection
-                trash.decomposing = 0 #Sets the decomposing value for the next time the trash is active again
-                inactive_trash.add(trash) #The trash is added to the inactive trash so it can be randomly selected to be put in the screen again
-                
-                if trash.cleaner_id is not None: #Checks if the trash had an asigned robot to clean it
-                    if not robots[trash.cleaner_id].get_returning(): #Checks if the robot is not coming back yet
-                        robots[trash.cleaner_id].set_motors_speed(0, 0) #Stops the robot
-                        #Reset the variables for the movement of the robot
-                        robots[trash.cleaner_id].set_integral(0) 
-                        robots[trash.cleaner_id].set_last_proportional(0)
-                        robots[trash.cleaner_id].set_intDist(0)
-                        robots[trash.cleaner_id].set_last_propDist(0)
-                        robots[trash.cleaner_id].set_backwards(False)
-                        robots[trash.cleaner_id].set_cnt(0)
-                        robots[trash.cleaner_id].set_firstDist(0)
-                        robots[trash.cleaner_id].set_moving(False)
-
-                        robots[trash.cleaner_id].set_returning(True) #Set the robot to start coming back
-                        robots[trash.cleaner_id].set_trash_picked(True) #Set as if the robot has already tried to pick up the trash
-                    trash.cleaner_id = None #Delete the robots id from the trash so it becomes unasigned for the next time it is active
+    contamination += 1 #Adds one point of contamination to the contamination points
+    contamination_text.update_counter(contamination, BLUE) #Updates the number to be displayd with the contamination points
+    contaminated_water_1.image.set_alpha(contamination*5) #The factor (*5) defines how fast the water start getting contaminated
+    trash.decomposing += 1 #Updates the decomposing counter of the trash
+    if trash.decomposing < 4: #Number of contaminations before totally decomposing and disappearing
+        trash.timer = timers.schedule(20000, DECOMPOSE, trash) #The trash contaminates again in 20 seconds
+    else: #The trash is totally decomposed and disappears
+        disappear_sound.play(loops = 0) #Plays a sound to indicate the trash was decomposed
+        active_trash.remove(trash) #The trash is removed from the active trash
+        all_sprites.remove(trash) #The trash is removed from the group of sprites to be blitted
+        remove_trash_position(trash.target_id) #Remove the trash position from the trash vector and updates the selection
+        trash.decomposing = 0 #Sets the decomposing value for the next time the trash is active again
+        inactive_trash.add(trash) #The trash is added to the inactive trash so it can be randomly selected to be put in the screen again
+        
+        cleaner = assignments.release_trash(trash) #The trash becomes unasigned for the next time it is active
+        if cleaner is not None: #Checks if the trash had an asigned robot to clean it
+            if not robots[cleaner].get_returning(): #Checks if the robot is not coming back yet
+                robots[cleaner].set_motors_speed(0, 0) #Stops the robot
+                #Reset the variables for the movement of the robot
+                robots[cleaner].set_integral(0) 
+                robots[cleaner].set_last_proportional(0)
+                robots[cleaner].set_intDist(0)
+                robots[cleaner].set_last_propDist(0)
+                robots[cleaner].set_backwards(False)
+                robots[cleaner].set_cnt(0)
+                robots[cleaner].set_firstDist(0)
+                robots[cleaner].set_moving(False)
+
+                robots[cleaner].set_returning(True) #Set the robot to start coming back
+                robots[cleaner].set_trash_picked(True) #Set as if the robot has already tried to pick up the trash
 
 #This method detects if a robot has bumped into an other robot, or if they are too close
 def detecting_collision():
@@ -981,8 +922,43 @@ def detecting_collision():
 
     return collision
 
-#Main loop of the game, this method is repeated each iteration
+#Kinect callback, it only copies the frame and leaves it for the game so a slow robot communication never stalls the depth stream
 def depth_frame_ready(frame):
+    slot = depth_ring.ingest(frame) #The kinect copies the frame once in a preallocated buffer where it is decoded to mm
+    if recorder is not None:
+        recorder.write(depth_ring.view(slot).T, ti.time()) #Only copies the frame, it is compressed and written by the recorder thread
+    frame_queue.put(slot) #If the game is behind the oldest frame waiting is dropped
+
+#Consumer of the depth frames, runs the game with the last frame received in its own thread
+def game_loop():
+    dropped = 0 #Frames dropped the last time it was reported
+    ticks = 0 #Frames used by the game since the last report
+    report_time = ti.time() #Time of the last report of dropped frames
+
+    while True:
+        slot = frame_queue.get_latest(1) #Waits at most 1 second for a frame
+        if slot is None:
+            continue
+        try:
+            game_tick(depth_ring.view(slot)) #Read only view of the actual depth data in mm
+        except Exception:
+            #An error in one frame only loses that frame, the game continues with the next one instead of stopping this thread
+            error('The game failed with a frame:\n' + traceback.format_exc())
+        finally:
+            depth_ring.release(slot) #The slot can be used again by the kinect
+        ticks += 1
+
+        #Reports at most once per second if frames were dropped because the game is not keeping up with the kinect, the frames per second
+        #the game is running show how many frames it can really process (replaying as fast as possible it is the maximum)
+        received, total_dropped, queue_depth, max_depth = frame_queue.stats()
+        if (total_dropped != dropped) & (ti.time() - report_time >= 1):
+            log('Game behind the depth stream at ' + str(round(ticks/(ti.time() - report_time), 1)) + ' fps: ' + str(total_dropped - dropped) + ' frames dropped (' + str(total_dropped) + ' of ' + str(received) + '), queue depth ' + str(queue_depth) + ', maximum ' + str(max_depth))
+            dropped = total_dropped
+            ticks = 0
+            report_time = ti.time()
+
+#Main loop of the game, this method is repeated with each depth frame
+def game_tick(depth):
     with screen_lock:
         global cleaners #Save the current robot selected or pause button
         global objective #Save the current trash selected
@@ -991,7 +967,6 @@ def depth_frame_ready(frame):
         global active_trash #Sprite group with all the trash in the screen
         global relocate #Value to re-map from the screen px to the kinect px or vice versa
         global ripples #Sprite group with the active ripples in the game
-        global start_time #Time when the game started or re-started
         global projection #Variable to control when to return to the game and start the splash sequence of images
         global start_counter #Counter to control wich splash image to blit
         global start #Variable that control if the game starts, gets paused or restarted
@@ -1000,22 +975,14 @@ def depth_frame_ready(frame):
         global restarting #Variable that controls when the game is re-starts
         global game_over #Variable that controls when the game is over
         global win #Variable that control when the user win
-        global freq2 #Variable that stores the most common value of the selection
-        global paused_time #Time in milliseconds the game have been paused
         global contaminated_water_image #Sprite that contains the image of the contaminated water
-        global s #Selection counter
         global change #Checks if is time to increase or decrease the guide text font
         global collision #Variable that save the position of the robot being checked in case there is a collition
         
-        #------------------------Taken from https://bitbucket.org/snippets/VitoGentile/Eoze/depth-data-visualization-with-pykinect-and------------------------
-        address = surface_to_array(tmp_s)
-        frame.image.copy_bits(address) #Copy raw data in a temp surface
-        del address
+        if floor.update(depth) is None: #Smoothed depth of the floor from a subsample of floor pixels, it also updates the heights derived from it
+            return #The floor can't be seen yet, like in the blank frames while the kinect starts, the time of this frame is run with the next one
 
-        depth = (pygame.surfarray.pixels2d(tmp_s) >> 3) & 4095 #Get actual depth data in mm
-        #------------------------------------------------------------------------------------------------------------------------------------------------------
-
-        floor = np.mean(depth[depth > 2100]) #Mean value of the floor to use as reference for the game heights
+        steps = rules.advance(ti.time()*1000) #Time of each step of the game rules to run in this frame, the clock is read once per frame
 
         # #Uncomment to plot the whole depth image 
         # pl.imshow(depth)
@@ -1024,33 +991,16 @@ def depth_frame_ready(frame):
         # raw_input("Press Enter to terminate.")
 
         #------------------------------------------Table Cutting and Cleanning---------------------------------------------------------------------------------------------------------------------------------------------------
-        #If there is a tall object before the table, to cut the table correctly the image checking will have to manually be set to start after the object position in the image and not in 0 (for columnI->160,X:120 and for rowI->X:160,120)
-        #To cut the table it is assumed that the middle of the kinect image (160,120) is on the table and not the floor
-        columnI = np.where((depth[160,0:120] >= floor/2.261) & (depth[160,0:120]<= floor/1.31)) #Checks in the row 160 from the column at the beggining of the image (0) to the column in the middle of the image (120), where pixels in the table range can be found
-        rowI = np.where((depth[0:160,120] >= floor/2.261) & (depth[0:160,120] <= floor/1.31)) #Checks in the row 160 from the column at the beggining of the image (0) to the column in the middle of the image (120), where pixels in the table range can be found
-        columnF = np.where((depth[rowI[0][0]+10,120:239]<= floor/2.261) | (depth[rowI[0][0]+10,120:239]>= floor/1.31)) #The final column is taken from a border of the table (rowI+10) so the hands or the body won't interfere in the cutting as they will if the row selected was the middle were the user is
-        rowF = np.where((depth[160:319,((((columnF[0][0]+120)-columnI[0][0])/2)+columnI[0][0]).astype(int)]<= floor/2.261) | (depth[160:319,((((columnF[0][0]+120)-columnI[0][0])/2)+columnI[0][0]).astype(int)]>= floor/1.31)) #The final row is checked in the column just in the middle of the table (Middle between columnF and columnI)
-        
-        #Cuts the table from the image. Due to the fact that coulmnF and rowF doesn't start in 0 their starting point to check have to be added, the 3 extra added and the 3 substracted from 
-        #rowI and columnI is to have 3 extra lines of pixels to let the kinect see the epuck a little closer to the edge, due to the 25x25 pixel square is cutted per robot for the orientation
-        #The indexing is to find the first appeareance of the value searched (table depth for initials and floor depth for finals) the rowF doesn't takes the first appearance because there was some mistake in the detection in middle of the table not sure why
-        depth = depth[rowI[0][0]-3:rowF[0][2]+163,columnI[0][0]-3:columnF[0][0]+123] 
-        
-        #Deletes the content of the 3 extra lines of pixels per side and clean also one line of the table in each side just to be sure there is no undesired pixel values in the table
-        depth[0:4,:] = floor/1.2435
-        depth[:,0:4] = floor/1.2435
-        depth[len(depth)-4:len(depth),:] = floor/1.2435
-        depth[:,len(depth[0])-4:len(depth[0])] = floor/1.2435
-        #------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
+        #The table borders are searched only the first time or if they moved, then the same cut is used every frame
+        if table.update(depth, floor):
+            #The factor used for the relocation between the screen coordinates and the kinect coordinates needs the pixels of the projection of the screen (theoretically screen width but there is a mistake with the projection size don't know due to what and manually 
+            #I set it lower so the location of robot's is more accurate), the length of the projection in mm, the table width in mm and also in the kinect pixels, the two -3 are due to the extra lines taken before
+            relocate = 1220/(projectionLength*((table.width-3-3)/tableWidth))
+            log('Table found in the kinect image, rows ' + str(table.rows.start) + ' to ' + str(table.rows.stop) + ' and columns ' + str(table.columns.start) + ' to ' + str(table.columns.stop))
 
-        depth = np.flipud(depth) #The image the kinect give is mirrored so it is needed to flip it
-
-        #The factor used for the relocation between the screen coordinates and the kinect coordinates needs the pixels of the projection of the screen (theoretically screen width but there is a mistake with the projection size don't know due to what and manually 
-        #I set it lower so the location of robot's is more accurate), the length of the projection in mm, the table width in mm and also in the kinect pixels, the two -3 are due to the extra lines taken before
-        relocate = 1220/(projectionLength*((len(depth[0])-3-3)/tableWidth)) 
-        arm = depth.copy()#A copy is generated so it can keep the arm for selection
-
-        depth[((depth <= floor/1.463 ) & (depth >= 0))] = floor/1.2435 #Threshold the image proportionallye to the floor so it deletes the arm
+        #Cuts the table in preallocated images, flips it because the image the kinect give is mirrored and deletes the arm from depth
+        #arm keeps the arm for selection, both images are overwritten next frame
+        depth, arm = preprocess.run(depth, table, floor)
 
         # #Uncomment to plot the depth image ignoring the arm
         # pl.figure(figsize=(8,10))
@@ -1069,15 +1019,20 @@ def depth_frame_ready(frame):
             all_sprites.add(types, layer = 1)
 
             coors = detecting(depth, arm) #Method that detects the position and orientation of the robots
-            pause_location = np.array([[(pause.rect.x+pause.rect.width/2)/relocate],[(pause.rect.y+pause.rect.height/2)/relocate]]) #Defines the position of the pause button in the top centered
-            coors = np.concatenate((coors, pause_location), axis = 1) #Adds the pause button to the possible objectives
+            targets.update(np.arange(1, len(robots) + 1), coors) #The robots are the objectives 1 to 4
+            targets.update([len(robots) + 1], [[(pause.rect.x+pause.rect.width/2)/relocate], [(pause.rect.y+pause.rect.height/2)/relocate]]) #The pause button in the top centered is the objective 5
+            coors, ids = targets.view(len(robots) + 1) #Only the robots and the pause button can be selected
             
-            positioning_trash() #Method that activates a new trash
-            updating_contamination() #Method that decompose each trash and the contamination points
+            for step in steps:
+                timers.tick(step) #Time played at this step
+                for event, trash in timers.due(): #Only the events whose time has come
+                    if event == SPAWN:
+                        positioning_trash() #Method that activates a new trash
+                    elif event == DECOMPOSE:
+                        updating_contamination(trash) #Method that decompose the trash and updates the contamination points
 
             if cleaners != 0: #This checks if a robot have been selected, because only in this case a trash can be selected, if there is no robot selected no trash can be selected
-                if newZones is not None: #Checks if there is any trash
-                    coors = np.concatenate((coors, newZones), axis = 1) #Add the trash to the objectives vector
+                coors, ids = targets.view() #The trash is added to the objectives, they are after the robots and the pause button
 
                 # #Uncomment to check the projection and the robots position coherence, this will project green circle in each robot position
                 # #It was used to calibrate the correct placement in the screen
@@ -1090,7 +1045,7 @@ def depth_frame_ready(frame):
                 # pl.show()
                 # raw_input("Press Enter to terminate.")
 
-            cleaners = selecting(arm, coors, floor) #This method checks what is the selection of the user
+            cleaners = selecting(arm, coors, floor, ids) #This method checks what is the selection of the user
 
             collision = detecting_collision() #This method checks if there is any collition between robots
             
@@ -1098,9 +1053,8 @@ def depth_frame_ready(frame):
             if (contamination >= 40) | (collision is not None): 
                 if collision is not None:
                     collision_sound.play(loops = 0) #In case of collition the collition sound is played, loops=0 indicates no repetitions only played once
-                s = 0 #The game will change to a menu so the selection must be restart
+                voter.clear() #The game will change to a menu so the selection must be restart and the previous selection cleaned to allow the buttons to be selected
                 cleaners = 0 #Clean the previous selection to allow the buttons to be selected
-                freq2 = np.zeros((1,2)) #Clean the previous most common selection to allow the buttons to be selected
                 game_over_sound.play(loops = 0) #The game over sound is played, loops=0 indicates no repetitions only played once
                 start = False #Stops the game to allow the menu to pop up
                 game_over = True #Defines that the game is over so the right images and menu are displayed
@@ -1108,10 +1062,9 @@ def depth_frame_ready(frame):
                     robot.set_motors_speed(0,0) #All the robots are stopped
 
             #If the user survives 3 minutes without getting to a critical contamination he wins
-            elif (ti.time()*1000 - start_time - paused_time) >= 180000: #The time the game have been paused is deleted from the time it have been running so only the real playing time is taken in consideration
-                s = 0 #The game will change to a menu so the selection must be restart
+            elif timers.now >= 180000: #The time the game have been paused is not counted so only the real playing time is taken in consideration
+                voter.clear() #The game will change to a menu so the selection must be restart and the previous selection cleaned to allow the buttons to be selected
                 cleaners = 0 #Clean the previous selection to allow the buttons to be selected
-                freq2 = np.zeros((1,2)) #Clean the previous most common selection to allow the buttons to be selected
                 win_sound.play(loops = 0) #The winning sound is played, loops=0 indicates no repetitions only played once
                 start = False #Stops the game to allow the menu to pop up
                 win = True #Defines that the user win so the right images and menu are displayed
@@ -1120,51 +1073,51 @@ def depth_frame_ready(frame):
 
             #Checks if the button paused was selected
             elif cleaners == 5:
-                s = 0 #The game will change to a menu so the selection must be restart
+                voter.clear() #The game will change to a menu so the selection must be restart and the previous selection cleaned to allow the buttons to be selected
                 cleaners = 0 #Clean the previous selection to allow the buttons to be selected
-                freq2 = np.zeros((1,2)) #Clean the previous most common selection to allow the buttons to be selected
                 start = False #Stops the game to allow the menu to pop up
                 paused = True #Defines that the game was paused so the right images and menu are displayed
+                timers.pause() #The time of the game stops until the game continues
                 for robot in robots:
                     robot.set_motors_speed(0,0) #All the robots are stopped
             else:
                 if objective is not None: #Checks if an objective was just selected
-                    obj = np.zeros((2,1)) #Auxiliar variable to save the objective coordinates
-                    obj[0] = coors[0, objective-1] #Objective row
-                    obj[1] = coors[1, objective-1] #Objective column
-
-                    for trash in active_trash: #Iterates all the trash in the screen
-                        if trash.array_position == objective-1: #Checks if the trash have the position that was just selected, the -1 its because in selection the selected position starts in 1 not 0
-                            trash.cleaner_id = (cleaners-1).astype(int) #If this is the trash selected then the robot selected position is saved in the trash (robot in charge of this trash)
-                            break #No trash can share the same position so it is not necessary to finish the FOR loop
-                    robots[(cleaners-1).astype(int)].set_objective(obj) #The robot saves the trash coordinates he have to clean
-                    robots[(cleaners-1).astype(int)].set_cleaning(True) #Set the robot control variable true to indicate the robot started the cleaning process
+                    trash = targets.owner(objective) #Trash with the number that was just selected, None if it disappeared in the meantime and then the robot is not sent
+                    if trash is not None:
+                        assignments.assign(int(cleaners-1), trash) #The robot selected is in charge of this trash
+                        obj = np.zeros((2,1)) #Auxiliar variable to save the objective coordinates
+                        obj[:,0] = targets.point(objective) #Objective row and column
+                        robots[(cleaners-1).astype(int)].set_objective(obj) #The robot saves the trash coordinates he have to clean
+                        robots[(cleaners-1).astype(int)].set_cleaning(True) #Set the robot control variable true to indicate the robot started the cleaning process
                     cleaners = 0 #Once the robot have been asigned to a trash the robot is erased from the selection so next time his leds won't turn off
                     objective = None #Cleans the objective variable so it enter here to assign the trash to a robot only once per trash
 
                 for i in range(0,len(robots)): #Iterates all the robots
                     if robots[i].get_cleaning(): #Checks if the robot is in the process of cleaning something so he will have to continue moving
-                        ripple = Ripple(robots[i].get_coors()[0], robots[i].get_coors()[1]) #Creates a ripple in the current position of the robot
-
                         if robots[i].get_trash_picked(): #Checks if the robot just arrived to the trash
                             print '!!!!!!!!!!!!!!!!!!RETURNING!!!!!!!!!!!!!!!!!!'
                             robots[i].set_objective(robots[i].get_initialPos()) #Setss the robot new objective to its base so he goes back to his position to dispose the trash
                             robots[i].set_trash_picked(False) #Indicates the trash was already picked if is the correct or left there if is the incorrect, so each robot only enter in this loop once
-                            for trash in active_trash: #Iterates all the trashin the screen
-                                if trash.cleaner_id == i: #Finds the trash that is assigned to the robot
-                                    if trash.trash_type != robots[i].get_cleaner_type(): #Checks if the robot type and the trash type are not the same
-                                        trash.cleaner_id = None #If the type is incorrect the trash robot ID is deleted so it can be assigned to an other robot
-                                        wrong_sound.play(loops = 0) #Sound that indicates that the trash type are not compatible
-                                        break #One robot can't have more than one trash assigned at the same time so it is not necessary to finish the FOR loop
+                            trash = assignments.trash_of(i) #Trash that is assigned to the robot
+                            if trash is not None:
+                                if trash.trash_type != robots[i].get_cleaner_type(): #Checks if the robot type and the trash type are not the same
+                                    assignments.release_robot(i) #If the type is incorrect the trash is released so it can be assigned to an other robot
+                                    wrong_sound.play(loops = 0) #Sound that indicates that the trash type are not compatible
                         
                         robots[i] = robots[i].move(depth) #Method in the E-puck class that control the movement of the robot, the depth argument is only for plotting purposes in case of an ERROR
 
-                for ripple in ripples: #Iterate all the ripples in the screen
-                    ripple.update_ripple() #Update th ripple image to a bigger ripple in case a ripple image has already been blitted twice, so the movement of the ripples is not to fast
-                    if not ripple.repeat:
-                        ripple.repeat = True #Sets the actual ripple image to be repeated once more before being changed
-                    else:
-                        ripple.repeat = False #After showing the same ripple twice allows the ripple image to be changed
+                for step in steps: #The ripples appear and grow with the steps of the game and not with the frames
+                    for robot in robots:
+                        if robot.get_cleaning(): #A robot cleaning leaves ripples in its path
+                            Ripple(robot.get_coors()[0], robot.get_coors()[1]) #Creates a ripple in the current position of the robot
+
+                    for ripple in ripples: #Iterate all the ripples in the screen
+                        ripple.update_ripple() #Update th ripple image to a bigger ripple in case a ripple image has already been blitted twice, so the movement of the ripples is not to fast
+                        if not ripple.repeat:
+                            ripple.repeat = True #Sets the actual ripple image to be repeated once more before being changed
+                        else:
+                            ripple.repeat = False #After showing the same ripple twice allows the ripple image to be changed
+                all_sprites.add([ripple for ripple in ripples if ripple.counter > 0], layer = 1) #The ripples already shown are blitted also in the frames without steps
 
                 screen.blit(background, (0, 0)) #Blit the background image
                 all_sprites.draw(screen) #Blit every active sprite that sould appear in the screen
@@ -1174,7 +1127,6 @@ def depth_frame_ready(frame):
             if not restarting: #Checks if the game is not being restarted
                 if paused: #Checks if the game was paused 
                     menu_locations = np.zeros((2,3)) #Creates an array to sent the pause menu buttons
-                    pause_beginning = ti.time()*1000 #Saves the time the pause started
                     for button in buttons_2: #Iterates the buttons for the pause menu
                         menu_locations[:, button.position-4] = np.array([[(button.rect.x+button.rect.width/2)/relocate],[(button.rect.y+button.rect.height/2)/relocate]])[:,0] #Adds each button position to the objective vector already in kinect coordinate system and centered
                 else:
@@ -1205,7 +1157,7 @@ def depth_frame_ready(frame):
                         splash_sound.play(loops = 0) #Plays a splash sound
                         cleaners = 0 #Deletes the last selection so it doesn't affect the game selections when it starts      
                 elif cleaners == 2: #The exit or X button is always number 2 regardless its screen position
-                    pygame.quit() #Exits the game
+                    quit_game() #Exits the game
                 elif cleaners == 3: #Checks if the button selected is restart in the pause menu
                     restarting = True #Sets the game to restart
                     paused = False #Sets paused to false so in case of a previous pause it doesn't try to rest the paused time at the end, is not needed because the game will restart
@@ -1230,7 +1182,7 @@ def depth_frame_ready(frame):
                     else:
                         robots[i] = robots[i].move(depth) #If the robot have an objective is because he have to return so it is set to move
 
-                if ready == 4: #Checks if the 4 robots are already in their base without objectives
+                if ready == len(robots): #Checks if all the robots are already in their base without objectives
                     initialization() #Set game variables to default
                     projection = True #Variable that indicates if is time to start showing th splash sequence of images to start or continue the game
                     splash_sound.play(loops = 0) #Plays a splash sound
@@ -1238,22 +1190,21 @@ def depth_frame_ready(frame):
                         robot.reseting() #Set robots variables to default
 
             if projection: #Checks if the sequence of splash images should begin so the game can start
-                pygame.time.wait(10) #This allows the splash no to be too fast, the wait time is set to 10 miliseconds
                 if start_counter < 13: #Checks if the splash image counter is not greater than the total number of splash images
                     screen.blit(sea_images[start_counter], (0, 0)) #Blits the splash image indicated by the counter
-                    start_counter += 1 #Updates the image so next time the image is changed
+                    start_counter += len(steps) #The image changes with each step of the game so the splash takes the same time with any frames per second
                 else:
-                    pygame.time.wait(20) #Sets an extra wait time so the sea foam image of dipping into the water stays a little longer before starting
                     screen.blit(background, (0, 0)) #Blits the background image
                     start = True #Allows the game to start
                     start_counter = 0 #Sets the splash image sequence to 0 so next time a menu pops up it will start again in the first image
                     cleaners = 0 #Reset the las selection so it won't affect the game selection
-                    s = 0 #Resets teh selection so a robot or trash can be selected correctly
-                    freq2 = np.zeros((1,2)) #Clean the previous most common selection to allow the robots and trash to be selected
+                    voter.clear() #Resets the selection and the previous one so a robot or trash can be selected correctly
 
                     if not paused:
-                        start_time = ti.time()*1000 #If the game is being restarted or just started, the initial time is set
+                        timers.begin(rules.time) #If the game is being restarted or just started, the time played starts from 0
+                        timers.schedule(offset_time, SPAWN) #The first trash appears after 9 seconds
                     else: 
+                        timers.resume(rules.time) #The time played continues from the pause
                         paused = False #If it was a pause the sets that the pause is over so next time the menu pops up for a game over or win, it doesn't think is a pause
 
                     projection = False #Sets the splash sequence to finish so next time the menu pops up and the splash image doesn't starts inmediatly
@@ -1266,23 +1217,23 @@ def depth_frame_ready(frame):
                     rect.y  = SCREEN_HEIGHT/2 - rect.height/2
                     screen.blit(restarting_image, (rect.x, rect.y)) #Blits the Restarting word image
 
-                    if start_counter == 36: #Checks if the counter of loading image sequence reached its maximum
-                        start_counter = 0 #Sets the sequence of loading image to restart
+                    start_counter %= 36 #The sequence of loading images restarts when it reaches its maximum
 
                     rect0 = loading[start_counter].get_rect() 
                     rect0.x  = rect.x + rect.width + 50 #Position the corner of the loading image next to the restarting image
                     rect0.y  = SCREEN_HEIGHT/2 - rect0.height/2 #Center the image in the Y axis
                     screen.blit(loading[start_counter], (rect0.x, rect0.y)) #Blits the loading image
-                    start_counter += 1 #Updates the counter of the loading image sequence
+                    start_counter += len(steps) #Updates the counter of the loading image sequence with the steps of the game
                 else: #If the game is not in the restarting process
-                    if change: #Checks if is time to make the guide text smaller
-                        guide_size -= 1 #Makes the font size of the guide text smaller
-                        if guide_size == 35: #Checks if the size of the font is the minimum
-                            change = False #Set change to false so the font size starts to increase again
-                    else: 
-                        guide_size += 1 #Makes the font size of the guide text bigger
-                        if guide_size == 55: #Checks if the size of the font is the maximum
-                            change = True #Set change to true so the font size starts to decrease again
+                    for step in steps: #The guide text changes its size once per step of the game
+                        if change: #Checks if is time to make the guide text smaller
+                            guide_size -= 1 #Makes the font size of the guide text smaller
+                            if guide_size == 35: #Checks if the size of the font is the minimum
+                                change = False #Set change to false so the font size starts to increase again
+                        else: 
+                            guide_size += 1 #Makes the font size of the guide text bigger
+                            if guide_size == 55: #Checks if the size of the font is the maximum
+                                change = True #Set change to true so the font size starts to decrease again
 
                     if game_over: #Checks if the game is over
                         contaminated_water_image.set_alpha(255) #Sets the transparency to 255 so the image is fully visible
@@ -1332,17 +1283,23 @@ def depth_frame_ready(frame):
                         screen.blit(selection_sprite.image, (selection_sprite.rect.x, selection_sprite.rect.y)) #Blits the pointer
             
             pygame.display.update() #Updates the screen so all the blitted images actually appear
-            if paused: #Checks if the game was paused
-                paused_time += (ti.time()*1000 - pause_beginning) #Adds the milliseconds that this pause loop took
+
+#Closes the recording if there is one and exits the game
+def quit_game():
+    global recorder #Saves the depth frames of the session
+
+    if recorder is not None:
+        recorder.close() #Writes the frames still waiting and the index of the recording
+        log('Recorded ' + str(recorder.written) + ' frames in ' + str(recorder.bytes/1000000) + ' MB, ' + str(recorder.dropped) + ' frames dropped')
+        recorder = None #The game can be closed twice, from the menu and from the window, and the recording is closed only once
+    pygame.quit()
 
 #Method that sets game variables to default    
 def initialization():
-    global s #Selection counter
     global cleaners #Save the current robot selected or pause button
     global objective #Save the current trash selected
     global firstLoop #Indicates if is the first loop of the game after starting or restarting
     global offset_time #Miliseconds between each trash appearance
-    global appearing_time #Time when the new trash should appear
     global inactive_trash #Sprite group with all the trash sprites that are not in the screen
     global active_trash #Sprite group with all the trash in the screen
     global all_sprites #Layered sprite group containig active sprites
@@ -1350,8 +1307,6 @@ def initialization():
     global score #Saves the score points
     global contaminated_water_1 #Sprite with the image of the contaminated water
     global ripples #Sprite group with the active ripples in the game
-    global freq2 #Variable that stores the most common value of the selection
-    global newZones #Vector with the positions of the trash in the screen
     global start #Variable that control if the game starts, gets paused or restarted
     global start_counter #Counter to control wich splash image to blit
     global projection #Variable to control when to return to the game and start the splash sequence of images
@@ -1364,19 +1319,16 @@ def initialization():
     global win #Variable that controls when the user win
     global contamination_text #Number of the contamination points
     global score_text #Sprite with the number to blit with the points
-    global paused_time #Time in milliseconds the game have been paused
     global collision #Variable that save the position of the robot being checked in case there is a collition
     
 
     # Global variables initialization
-    s = None
+    voter.clear()
     cleaners = 0
     objective = None
     firstLoop = True
     contamination = 0
     score = 0
-    freq2 = np.zeros((1,2))
-    newZones = None
     start = False
     start_counter = 0
     projection = False
@@ -1385,13 +1337,10 @@ def initialization():
     paused = False
     game_over = False
     win = False
-    paused_time = 0
     collision = None
 
     #Time for the trash first appearing 9s (9000 ms)
     offset_time = 9000
-    #Initial time for next appeareance
-    appearing_time = 9000
 
     selection_sprite = None
 
@@ -1403,29 +1352,40 @@ def initialization():
         all_sprites.empty()
         all_sprites.add(walls, layer = 0)
         all_sprites.add(contaminated_water_1, layer = contaminated_water_1.layer)
+        for trash in active_trash:
+            targets.remove(trash.target_id) #The trash is not an objective any more
+        assignments.clear() #No robot is cleaning anything
+        building_occupancy() #The trash and the bases of the robots leave the screen, the bases are found again in the first loop
         inactive_trash.add(active_trash)
         active_trash.empty()
 
     restarting = False
 
 def main():
+    #The depth frames can come from the kinect or from a recorded session to run the game without the kinect
+    parser = argparse.ArgumentParser(description = 'Save the sea!')
+    parser.add_argument('--replay', help = 'Recorded depth session to use instead of the kinect')
+    parser.add_argument('--speed', type = float, default = 1, help = 'Replay speed as a multiple of the recorded rate, 0 to replay as fast as possible')
+    parser.add_argument('--loop', action = 'store_true', help = 'Replay the recorded session again when it is over')
+    parser.add_argument('--record', help = 'File where the depth frames of the session are recorded')
+    args = parser.parse_args()
+
+    if (args.replay is None) & (nui is None):
+        error('The kinect library is not available, use --replay with a recorded session')
+        sys.exit(1)
+
     # Initialize PyGame
     pygame.init()
 
     # Global variables values that need to be kept for more than one loop
     global screen #Surface to blit on
-    global s #Selection counter
-    global sel #Vector to store the sequence of selections to fin the most common
-    global freq #Stores the value of the most frequent selection in the first 10 selections, in case there is a mistake due to the 
-    #3D pointing vector uncertainty showing no selection, if the correct selections of an objective is at least 7 from 10 the tentative selection is made
     global cleaners #Save the current robot selected or pause button
     global robots #Object of each robot
+    global poses #Filtered pose of each robot
     global objective #Save the current trash selected
     global firstLoop #Indicates if is the first loop of the game after starting or restarting
     global background #Background image of the sand floor in the sea
     global offset_time #Miliseconds between each trash appearance
-    global start_time #Time when the game started or re-started
-    global appearing_time #Time when the new trash should appear
     global screen_robots #Sprite group with the robots screen position
     global inactive_trash #Sprite group with all the trash sprites that are not in the screen
     global active_trash #Sprite group with all the trash in the screen
@@ -1442,8 +1402,7 @@ def main():
     global waves_sound #Sound of the whole game, sea waves
     global ripples #Sprite group with the active ripples in the game
     global ripples_images #Ripple sequence of images
-    global freq2 #Variable that stores the most common value of the selection
-    global newZones #Vector with the positions of the trash in the screen
+    global targets #Objectives that can be selected
     global start #Variable that control if the game starts, gets paused or restarted
     global sea_images #Splash sequence of images
     global start_counter #Counter to control wich splash image to blit
@@ -1477,7 +1436,7 @@ def main():
     global collision_sound #Sound played when a robot bump into an other
     global collision #Variable that save the position of the robot being checked in case there is a collition
     global collision_image #Image blitted when a robot bump into an other
-    global paused_time #Time in milliseconds the game have been paused
+    global recorder #Saves the depth frames of the session
 
     restarting = False
     trash_counter = 0
@@ -1487,6 +1446,7 @@ def main():
 
     #Connecting robots in the same order the kinect will detect them (left to right, top to bottom), keep in mind kinect image is going to be flip upside down 
     robots = [initRobots('2486'), initRobots('3047'), initRobots('3067'), initRobots('3078')]
+    poses = [PoseFilter() for robot in robots] #Same order than robots
     
     #Screen size
     screen = pygame.display.set_mode((SCREEN_WIDTH,SCREEN_HEIGHT), 0, 24)
@@ -1625,6 +1585,8 @@ def main():
     type2 = Type(pygame.image.load("Images/type 2.png").convert_alpha(), 2)
     type3 = Type(pygame.image.load("Images/type 3.png").convert_alpha(), 3)
 
+    building_occupancy() #Space of the screen where trash can't be put
+
     #Position of the game title, includes width, height, x and y coordinates
     rect1 = title.get_rect()
     rect1.x  = SCREEN_WIDTH/2 - rect1.width/2
@@ -1659,21 +1621,41 @@ def main():
         #Counter to upload the next image
         trash_counter += 1
 
-    with nui.Runtime() as kinect:
+    #Objectives of the selection, the robots are the numbers 1 to 4 in their order and the pause button 5, each trash takes a free number when it appears
+    targets = TargetRegistry(len(robots) + 1 + len(inactive_trash))
+    for robot in robots:
+        targets.add((0, 0)) #The positions of the robots and the pause button are updated every frame
+    targets.add((0, 0))
+
+    if args.replay is not None:
+        log('Replaying ' + args.replay + ' at speed ' + str(args.speed))
+        runtime = ReplayRuntime(args.replay, args.speed, args.loop) #Sends the recorded frames to the same callback than the kinect
+    else:
+        runtime = nui.Runtime()
+
+    if args.record is not None:
+        log('Recording the session in ' + args.record)
+        recorder = DepthRecorder(args.record, DEPTH_WINSIZE)
+
+    with runtime as kinect:
         
         kinect.depth_frame_ready += depth_frame_ready
-        kinect.depth_stream.open(nui.ImageStreamType.Depth, 2, nui.ImageResolution.Resolution320x240, nui.ImageType.Depth)
+        if args.replay is not None:
+            kinect.depth_stream.open()
+        else:
+            kinect.depth_stream.open(nui.ImageStreamType.Depth, 2, nui.ImageResolution.Resolution320x240, nui.ImageType.Depth)
+        thread.start_new_thread(game_loop, ()) #The game runs in its own thread with the frames the kinect leaves in the queue
         
         # Main game loop
         while True:
             event = pygame.event.wait()
             if event.type == pygame.QUIT:
-                pygame.quit()
+                quit_game()
 
             if event.type == pygame.KEYDOWN:
                 #Close the game when pressing Q
                 if event.key == pygame.K_q:
-                    pygame.quit()
+                    quit_game()
                 #Kinect camera angle can't be changed while hanging looking to the table it will move more than one degree to another fixed position
                 #Increase kinect camera angle in 1 degree when W is pressed and prints the current angle in the command line
                 elif event.key == pygame.K_w:
@@ -0,0 +1,324 @@
+from __future__ import division
+import numpy as np
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Selection of an objective (a robot, the pause button, a trash or a menu button) from the objective pointed in each frame
+
+#Votes of the objective pointed in each frame. The first votes pre-select the most voted objective if it has enough of them and the
+#pre-selection becomes a selection if it keeps enough votes until the window is full, otherwise the selection starts again.
+#The objectives are voted by a stable number, 0 when nothing is pointed, so an objective can be removed without changing the other votes.
+#The votes are kept in a ring with a count per objective updated with each vote, so a vote or a removal costs the same with any number of objectives
+class SelectionVoter(object):
+
+    #Results of a vote
+    VOTING = 'voting' #The selection continues
+    NOTHING = 'nothing' #Nothing was pointed in most of the first votes, the selection starts again
+    RESELECTING = 'reselecting' #The pre-selected objective is the one already selected, the selection starts again
+    INSUFFICIENT = 'insufficient' #The most voted objective doesn't have enough votes to be pre-selected, the selection starts again
+    PRESELECTED = 'preselected' #An objective has been pre-selected, it is in candidate
+    DIFFERENT = 'different' #Another objective got more votes than the pre-selected one, the selection starts again
+    NOT_CONSTANT = 'not constant' #The pre-selected objective didn't keep enough votes, the selection starts again
+    SELECTED = 'selected' #The pre-selected objective is selected, it is in selected
+
+    def __init__(self, preview = 10, preselect = 7, window = 22, commit = 16):
+        self.preview = preview #Votes used for the pre-selection
+        self.preselect = preselect #Votes of the preview needed to pre-select an objective
+        self.window = window #Votes used for the selection
+        self.commit = commit #Votes of the window needed to select the pre-selected objective
+        self.ring = [0]*window #Objective voted in each frame
+        self.generations = [0]*window #Times the objective of each vote had been removed when it was voted, votes from before a removal are not counted
+        self.start = 0 #Position of the oldest vote in the ring
+        self.length = 0 #Votes in the ring
+        self.counts = {} #Votes of each objective in the ring
+        self.removed = {} #Times each objective has been removed, a removed number can be used again by a new objective
+        self.leader = 0 #Objective with more votes
+        self.candidate = None #Objective pre-selected
+        self.selected = None #Last objective selected
+
+    #Votes of the current selection
+    def __len__(self):
+        return self.length
+
+    #Starts the selection again, the last objective selected is kept so it is not selected twice
+    def reset(self):
+        self.start = 0
+        self.length = 0
+        self.counts.clear()
+        self.leader = 0
+        self.candidate = None
+
+    #Starts the selection again and forgets the last objective selected, used when the objectives change like when a menu appears
+    def clear(self):
+        self.reset()
+        self.selected = None
+
+    #The objective is not there any more, its votes stop counting without changing the rest of the ring
+    def remove(self, target):
+        self.removed[target] = self.removed.get(target, 0) + 1
+        self.counts.pop(target, None)
+        if self.candidate == target:
+            self.reset() #The objective being selected disappeared so the selection starts again
+        elif self.leader == target:
+            self.leader = self.top()
+        if self.selected == target:
+            self.selected = None
+
+    #Most voted objective, only needed when the leader loses votes
+    def top(self):
+        return max(self.counts, key = self.counts.get) if self.counts else 0
+
+    #Adds a vote to the ring, if it is full the oldest vote leaves
+    def add(self, target):
+        if self.length == self.window:
+            oldest = self.ring[self.start]
+            if self.generations[self.start] == self.removed.get(oldest, 0):
+                self.counts[oldest] -= 1
+            self.start = (self.start + 1) % self.window
+            self.length -= 1
+            if oldest == self.leader:
+                self.leader = self.top()
+
+        index = (self.start + self.length) % self.window
+        self.ring[index] = target
+        self.generations[index] = self.removed.get(target, 0)
+        self.length += 1
+        self.counts[target] = self.counts.get(target, 0) + 1
+        if self.counts[target] > self.counts.get(self.leader, 0):
+            self.leader = target
+
+    #Votes of an objective
+    def votes(self, target):
+        return self.counts.get(target, 0)
+
+    #Adds the objective pointed in this frame and returns the result
+    def vote(self, target):
+        self.add(target)
+
+        if self.length == self.preview:
+            leader = self.leader
+            if leader == 0:
+                self.reset()
+                return self.NOTHING
+            if leader == self.selected:
+                self.reset()
+                return self.RESELECTING
+            if self.votes(leader) < self.preselect:
+                self.reset()
+                return self.INSUFFICIENT
+            self.candidate = leader
+            return self.PRESELECTED
+
+        if self.length == self.window:
+            leader = self.leader
+            candidate = self.candidate
+            enough = self.votes(leader) >= self.commit
+            self.reset() #Selected or not the next selection starts from zero
+            if leader != candidate:
+                self.selected = None #The selection wasn't effective so the same objective can be selected again
+                return self.DIFFERENT
+            if not enough:
+                self.selected = None
+                return self.NOT_CONSTANT
+            self.selected = leader
+            return self.SELECTED
+
+        return self.VOTING
+
+
+#Votes with a sequential test instead of fixed windows, so a selection where every vote agrees is made after a few frames and one that is
+#clearly lost starts again without waiting the whole window. The most voted objective is tested: each vote for it adds log(hit/confusion)
+#and each other vote adds log((1 - hit)/(1 - confusion)) to the evidence of the user pointing at it, the objective is selected when the
+#evidence passes the threshold given by false_selection and the selection starts again when it falls below the one given by missed.
+#If the window is full without a decision the selection is not constant and starts again
+class SequentialVoter(SelectionVoter):
+
+    def __init__(self, hit = 0.85, confusion = 0.3, false_selection = 0.01, missed = 0.05, minimum = 5, window = 22):
+        SelectionVoter.__init__(self, preview = minimum, window = window)
+        self.minimum = minimum #Votes needed before selecting, so the pointer is seen before the selection
+        self.agree = np.log(hit/confusion) #Evidence added by a vote for the tested objective
+        self.disagree = np.log((1 - hit)/(1 - confusion)) #Evidence added by any other vote
+        self.upper = np.log((1 - missed)/false_selection) #Evidence needed to select
+        self.lower = np.log(missed/(1 - false_selection)) #Evidence under which the selection starts again
+
+    #Evidence of the user pointing at the most voted objective, nothing pointed can't be selected so it only adds disagreeing votes
+    def evidence(self):
+        votes = self.votes(self.leader) if self.leader != 0 else 0
+        return votes*self.agree + (self.length - votes)*self.disagree
+
+    #Adds the objective pointed in this frame and returns the result
+    def vote(self, target):
+        self.add(target)
+        evidence = self.evidence()
+
+        if (evidence >= self.upper) & (self.length >= self.minimum):
+            leader = self.leader
+            self.reset()
+            if leader == self.selected:
+                return self.RESELECTING
+            self.selected = leader
+            return self.SELECTED
+
+        if evidence <= self.lower:
+            leader = self.leader
+            self.reset()
+            return self.NOTHING if leader == 0 else self.INSUFFICIENT
+
+        if self.length == self.window:
+            self.reset()
+            self.selected = None
+            return self.NOT_CONSTANT
+
+        if (self.leader != 0) & (self.leader != self.candidate) & (self.leader != self.selected) & (evidence > 0):
+            self.candidate = self.leader #The objective tested changed, it is shown as pre-selected, the one already selected is not pre-selected again
+            return self.PRESELECTED
+        return self.VOTING
+
+
+#Low pass filter of the point the user is pointing at with a cutoff that grows with its speed (1 euro filter), the point stays still when
+#the hand is still and follows it without delay when it moves. The state belongs to one pointing, it is reset when the arm leaves the table
+class PointerFilter(object):
+
+    def __init__(self, cutoff = 1.0, beta = 0.05, derivative_cutoff = 1.0):
+        self.cutoff = cutoff #Cutoff frequency in Hz when the point is still
+        self.beta = beta #Increase of the cutoff frequency in Hz per pixel per second of speed
+        self.derivative_cutoff = derivative_cutoff #Cutoff frequency in Hz of the speed used to change the cutoff
+        self.value = None #Filtered point
+        self.speed = None #Filtered speed in pixels per second
+        self.time = None #Time of the last point in seconds
+
+    #Forgets the point, the next one is used as it comes
+    def reset(self):
+        self.value = None
+        self.speed = None
+        self.time = None
+
+    #Weight of a new value for a low pass filter with that cutoff frequency after dt seconds
+    @staticmethod
+    def smoothing(cutoff, dt):
+        tau = 1/(2*np.pi*cutoff)
+        return 1/(1 + tau/dt)
+
+    #Filters a point measured at time seconds and returns the filtered point
+    def filter(self, point, time):
+        point = np.asarray(point, dtype = np.float64)
+        if self.value is None:
+            self.value = point.copy()
+            self.speed = np.zeros_like(point)
+            self.time = time
+            return self.value.copy()
+
+        dt = time - self.time
+        if dt <= 0:
+            return self.value.copy() #Same frame again, nothing new to filter
+        self.time = time
+
+        self.speed += self.smoothing(self.derivative_cutoff, dt)*((point - self.value)/dt - self.speed)
+        cutoff = self.cutoff + self.beta*np.sqrt(np.sum(self.speed**2))
+        self.value += self.smoothing(cutoff, dt)*(point - self.value)
+        return self.value.copy()
+
+
+#Objectives that can be selected with a number that doesn't change while the objective exists. The points are kept together in a preallocated
+#array so the distances to all of them are found with one operation: removing an objective moves the last one to its place, so the numbers
+#never change but the positions can. A removed number goes to a free list and is given to the next objective added
+class TargetRegistry(object):
+
+    def __init__(self, capacity):
+        self.points = np.zeros((2, capacity)) #Row and column of each objective by position
+        self.ids = np.zeros(capacity, dtype = int) #Number of the objective in each position
+        self.slots = np.zeros(capacity + 1, dtype = int) #Position of each number, numbers start in 1 because 0 is nothing selected
+        self.owners = [None]*(capacity + 1) #Object of each number, like the sprite of a trash
+        self.free = list(range(capacity, 0, -1)) #Numbers not used, the smallest is given first
+        self.count = 0 #Objectives in the registry
+
+    def __len__(self):
+        return self.count
+
+    #Adds an objective in a point and returns its number, owner is the object it belongs to
+    def add(self, point, owner = None):
+        if not self.free:
+            raise ValueError('There is no space for more objectives')
+        target = self.free.pop()
+        self.slots[target] = self.count
+        self.ids[self.count] = target
+        self.points[:, self.count] = point
+        self.owners[target] = owner
+        self.count += 1
+        return target
+
+    #Removes an objective, the last one takes its position
+    def remove(self, target):
+        slot = self.slots[target]
+        last = self.count - 1
+        self.points[:, slot] = self.points[:, last]
+        self.ids[slot] = self.ids[last]
+        self.slots[self.ids[slot]] = slot
+        self.count = last
+        self.owners[target] = None
+        self.free.append(target)
+
+    #Moves the objectives with those numbers to the points given, one per column
+    def update(self, targets, points):
+        self.points[:, self.slots[targets]] = points
+
+    #Point of an objective
+    def point(self, target):
+        return self.points[:, self.slots[target]]
+
+    #Object of an objective, None if the number is not used
+    def owner(self, target):
+        return self.owners[target]
+
+    #Position of an objective starting in 1 like the selection
+    def position(self, target):
+        return 1 + self.slots[target]
+
+    #Points and numbers of the first objectives, all of them if count is not given, they are views of the registry and not copies
+    def view(self, count = None):
+        count = self.count if count is None else min(count, self.count)
+        return self.points[:, :count], self.ids[:count]
+
+
+#Trash assigned to each robot and robot assigned to each trash, kept together so both can be found without looking at all the trash.
+#A robot has at most one trash and a trash at most one robot, assigning one of them again releases its previous pair
+class AssignmentIndex(object):
+
+    def __init__(self):
+        self.trash = {} #Trash of each robot
+        self.robots = {} #Robot of each trash
+
+    #The robot is sent to clean the trash
+    def assign(self, robot, trash):
+        self.release_robot(robot)
+        self.release_trash(trash)
+        self.trash[robot] = trash
+        self.robots[trash] = robot
+
+    #Trash assigned to the robot, None if it has no trash
+    def trash_of(self, robot):
+        return self.trash.get(robot)
+
+    #Robot assigned to the trash, None if it has no robot
+    def robot_of(self, trash):
+        return self.robots.get(trash)
+
+    #The robot has no trash any more, returns the trash it had
+    def release_robot(self, robot):
+        trash = self.trash.pop(robot, None)
+        if trash is not None:
+            del self.robots[trash]
+        return trash
+
+    #The trash has no robot any more, returns the robot it had
+    def release_trash(self, trash):
+        robot = self.robots.pop(trash, None)
+        if robot is not None:
+            del self.trash[robot]
+        return robot
+
+    #Releases all the robots and trash
+    def clear(self):
+        self.trash.clear()
+        self.robots.clear()
@@ -0,0 +1,105 @@
+from __future__ import division
+import heapq
+import itertools
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Timers of the game rules measured in the time the game has been played
+
+#Events waiting for their time in a heap ordered by deadline, so each frame only the events that are due are taken out and the
+#rest are not even looked at. The clock is read once per frame with tick and the time paused is not counted, so the trash doesn't
+#decompose and new trash doesn't come while the pause menu is shown. All the times are in miliseconds like the rest of the game
+class GameTimers(object):
+
+    def __init__(self):
+        self.heap = [] #Events as [deadline, order, event, subject], the order keeps the events with the same deadline in the order they were scheduled
+        self.order = itertools.count() #Number of each event scheduled
+        self.start = None #Clock time when the game started
+        self.paused = 0 #Miliseconds the game has been paused
+        self.pause_beginning = None #Clock time when the current pause started, None if the game is not paused
+        self.clock = None #Clock time of the last tick
+        self.now = 0 #Miliseconds played at the last tick
+
+    #Starts the game at that clock time without events
+    def begin(self, clock):
+        del self.heap[:]
+        self.start = clock
+        self.paused = 0
+        self.pause_beginning = None
+        self.clock = clock
+        self.now = 0
+
+    #Stops the time of the game at the last tick
+    def pause(self):
+        if self.pause_beginning is None:
+            self.pause_beginning = self.clock
+
+    #The time of the game continues from where it was paused
+    def resume(self, clock):
+        if self.pause_beginning is not None:
+            self.paused += clock - self.pause_beginning
+            self.pause_beginning = None
+        self.clock = clock
+
+    #Reads the clock of this frame, returns the miliseconds played
+    def tick(self, clock):
+        self.clock = clock
+        if self.pause_beginning is None:
+            self.now = clock - self.start - self.paused
+        return self.now
+
+    #Event that happens delay miliseconds after the last tick, subject is what the event is about like the trash that decomposes.
+    #Returns the entry of the event to cancel it
+    def schedule(self, delay, event, subject = None):
+        entry = [self.now + delay, next(self.order), event, subject]
+        heapq.heappush(self.heap, entry)
+        return entry
+
+    #The event won't happen, it stays in the heap until its deadline but it is skipped
+    def cancel(self, entry):
+        if entry is not None:
+            entry[2] = None
+            entry[3] = None
+
+    #Takes out the events that are due at the last tick as (event, subject), the events scheduled while they are taken out are also
+    #taken if they are due
+    def due(self):
+        while self.heap and (self.heap[0][0] <= self.now):
+            deadline, order, event, subject = heapq.heappop(self.heap)
+            if event is not None:
+                yield event, subject
+
+    #Events waiting, including the cancelled ones
+    def __len__(self):
+        return len(self.heap)
+
+
+#Clock of the game rules that advances in steps of the same duration whatever the frames per second. The time of each frame is added to
+#an accumulator and the rules run once for each whole step in it, so the game plays the same when the vision drops frames and the rest
+#of the time waits for the next frame. At most limit steps are run in one frame, after a long stall the game continues instead of
+#running all the steps lost
+class FixedStep(object):
+
+    def __init__(self, step = 1000/30, limit = 5):
+        self.step = step #Miliseconds of each step, the rate of the kinect so the game plays as it did with one step per frame
+        self.limit = limit #Steps run at most in one frame
+        self.last = None #Clock time of the last frame
+        self.accumulator = 0 #Miliseconds of the frames not used yet by a step
+        self.time = 0 #Miliseconds of all the steps run
+
+    #Adds the time since the last frame and returns the time of each step to run in this frame, none in the first frame
+    def advance(self, clock):
+        if self.last is not None:
+            self.accumulator += clock - self.last
+        self.last = clock
+
+        count = int(self.accumulator//self.step)
+        if count > self.limit:
+            self.accumulator -= (count - self.limit)*self.step #The time that can't be run is lost
+            count = self.limit
+        self.accumulator -= count*self.step
+
+        steps = [self.time + (i + 1)*self.step for i in range(count)]
+        self.time += count*self.step
+        return steps
@@ -0,0 +1,137 @@
+from __future__ import division
+from scipy.optimize import linear_sum_assignment
+import numpy as np
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Estimation of the robots state between the frames of the kinect
+
+#Wraps an angle difference in degrees to [-90, 90), the orientation of a robot is found from its shape so it has a period of 180 degrees
+def wrap_heading(angle):
+    return (angle + 90) % 180 - 90
+
+#Kalman filter with constant velocity for the pose of one robot, the state is (row, column, heading, row speed, column speed, heading speed)
+#in pixels, degrees and seconds. The pose is predicted every frame so if the robot is hidden by an arm or not detected the prediction is used,
+#and measurements too far from the prediction are ignored instead of moving the robot. An orientation that jumps flip degrees or more from the
+#prediction is a mistake of the shape of the robot, so only the position of that measurement is used and the orientation is never taken
+class PoseFilter(object):
+
+    def __init__(self, position_noise = 1.0, heading_noise = 5.0, acceleration = 50.0, turning = 200.0, gate = 11.34, position_gate = 9.21, flip = 35.0, patience = 5):
+        self.R = np.diag([position_noise**2, position_noise**2, heading_noise**2]) #Covariance of the measurements
+        self.acceleration = acceleration #Standard deviation of the changes of speed in pixels per second squared
+        self.turning = turning #Standard deviation of the changes of the heading speed in degrees per second squared
+        self.gate = gate #Maximum squared Mahalanobis distance of a measurement to be accepted, 11.34 is the 99% for 3 dimensions
+        self.position_gate = position_gate #The same when only the position is used, 9.21 is the 99% for 2 dimensions
+        self.flip = flip #Change of orientation in degrees from which the measured orientation is ignored, between it and 90 it is a wrong angle
+        self.patience = patience #Consecutive rejected measurements before thinking the robot was moved and starting again from the measurement
+        self.H = np.hstack((np.eye(3), np.zeros((3, 3)))) #Part of the state that is measured
+        self.x = None #State
+        self.P = None #Covariance of the state
+        self.time = None #Time of the state in seconds
+        self.misses = 0 #Consecutive frames without an accepted measurement
+        self.rejected = 0 #Consecutive measurements rejected
+
+    #Starts the filter in a measured pose without speed
+    def initialize(self, position, heading, time):
+        self.x = np.array([position[0], position[1], wrap_heading(heading), 0., 0., 0.])
+        self.P = np.diag([self.R[0,0], self.R[1,1], self.R[2,2], 100., 100., 1000.])
+        self.time = time
+        self.misses = 0
+        self.rejected = 0
+
+    #Checks if the filter already has a pose
+    def initialized(self):
+        return self.x is not None
+
+    #Moves the state to the time given
+    def predict(self, time):
+        if self.x is None:
+            self.time = time #Time of the first measurement if it comes before initializing
+            return
+        if self.time is None:
+            self.time = time #Started without time, the state is from this frame
+            return
+        dt = max(time - self.time, 0)
+        self.time = time
+        if dt == 0:
+            return
+
+        F = np.eye(6)
+        F[0,3] = F[1,4] = F[2,5] = dt
+        #Noise of a random acceleration during dt for each axis
+        block = np.array([[dt**4/4, dt**3/2], [dt**3/2, dt**2]])
+        Q = np.zeros((6, 6))
+        for axis, noise in ((0, self.acceleration), (1, self.acceleration), (2, self.turning)):
+            Q[np.ix_((axis, axis + 3), (axis, axis + 3))] = block*noise**2
+
+        self.x = F.dot(self.x)
+        self.x[2] = wrap_heading(self.x[2])
+        self.P = F.dot(self.P).dot(F.T) + Q
+
+    #Corrects the state with a measured pose, returns False if the measurement was rejected. A filter without pose starts from the measurement
+    def update(self, position, heading):
+        if self.x is None:
+            self.initialize(position, heading, self.time)
+            return True
+
+        y = np.array([position[0], position[1], heading]) - self.H.dot(self.x)
+        y[2] = wrap_heading(y[2])
+        if abs(y[2]) < self.flip:
+            measured, gate = [0, 1, 2], self.gate
+        else:
+            measured, gate = [0, 1], self.position_gate #A wrong orientation, it is never taken even if it repeats, only the position is used
+        H = self.H[measured]
+        y = y[measured]
+        S = H.dot(self.P).dot(H.T) + self.R[np.ix_(measured, measured)]
+        Sinv = np.linalg.inv(S)
+
+        if y.dot(Sinv).dot(y) > gate:
+            self.rejected += 1
+            if self.rejected >= self.patience:
+                self.initialize(position, heading, self.time) #The measurements keep being far so the robot was moved or the filter lost it
+                return True
+            return False
+
+        K = self.P.dot(H.T).dot(Sinv)
+        self.x = self.x + K.dot(y)
+        self.x[2] = wrap_heading(self.x[2])
+        self.P = (np.eye(6) - K.dot(H)).dot(self.P)
+        self.misses = 0
+        self.rejected = 0
+        return True
+
+    #The robot wasn't detected in this frame, the predicted pose is kept
+    def miss(self):
+        self.misses += 1
+
+    #Filtered row and column
+    def position(self):
+        return self.x[0:2].copy()
+
+    #Filtered heading in degrees
+    def heading(self):
+        return self.x[2]
+
+    #Covariance of the pose (row, column, heading)
+    def covariance(self):
+        return self.P[0:3,0:3].copy()
+
+
+#Matches the detections of a frame to the robots with the smallest total distance, each robot gets at most one detection and a pair farther
+#than gate pixels is never made. tracks and detections are arrays with a row and a column per row. Returns the pairs (detection, track),
+#the detections that are not a robot and the robots that were not detected
+def assign(tracks, detections, gate = 30):
+    tracks = np.asarray(tracks, dtype = np.float64).reshape(-1, 2)
+    detections = np.asarray(detections, dtype = np.float64).reshape(-1, 2)
+    matches = []
+    if len(tracks) > 0 and len(detections) > 0:
+        distance = np.hypot(detections[:,None,0] - tracks[None,:,0], detections[:,None,1] - tracks[None,:,1])
+        cost = np.where(distance > gate, 1e6, distance) #Pairs out of the gate are only made if there is no other option, then they are dropped
+        for detection, track in zip(*linear_sum_assignment(cost)):
+            if distance[detection, track] <= gate:
+                matches.append((int(detection), int(track)))
+
+    detected = set(detection for detection, track in matches)
+    tracked = set(track for detection, track in matches)
+    return matches, [i for i in range(len(detections)) if i not in detected], [i for i in range(len(tracks)) if i not in tracked]
@@ -0,0 +1,652 @@
+from __future__ import division
+from scipy.ndimage import measurements, morphology
+import numpy as np
+import warnings
+
+#Save the sea by Andres Cubides
+#In case of any question write to andrescamiloc@hotmail.com
+
+#Image processing of the depth frames that doesn't depend on the game state
+
+#Position of the table in the kinect image. The table and the kinect don't move during a session so the borders are searched once
+#and then the same slices are used every frame, the borders are searched again only if the depth around them changes
+class TableROI(object):
+
+    def __init__(self, tolerance = 30, patience = 15):
+        self.rows = None #Slice of the first axis of the kinect image where the table is, includes 3 extra lines per side
+        self.columns = None #Slice of the second axis of the kinect image where the table is, includes 3 extra lines per side
+        self.width = 0 #Length of the second axis of the cut table
+        self.tolerance = tolerance #Difference in mm of the depth around the borders to think the table or the kinect moved
+        self.patience = patience #Consecutive frames with the borders changed before searching them again, so an arm crossing a border doesn't do it
+        self.changed = 0 #Consecutive frames the borders have been different
+        self.calibrations = 0 #Number of times the borders have been searched
+
+    #Searches the table borders the first time and again only if they moved, returns True when the borders were searched, floor has the heights of the game
+    def update(self, depth, floor):
+        if self.rows is None:
+            self.calibrate(depth, floor)
+            return True
+
+        if self.drifted(depth):
+            self.changed += 1
+            if self.changed >= self.patience:
+                self.calibrate(depth, floor)
+                return True
+        else:
+            self.changed = 0
+        return False
+
+    #Searches the borders of the table in the depth image
+    def calibrate(self, depth, floor):
+        #If there is a tall object before the table, to cut the table correctly the image checking will have to manually be set to start after the object position in the image and not in 0 (for columnI->160,X:120 and for rowI->X:160,120)
+        #To cut the table it is assumed that the middle of the kinect image (160,120) is on the table and not the floor
+        near, far = floor.table #Depth band of the table proportional to the floor
+        columnI = np.where((depth[160,0:120] >= near) & (depth[160,0:120]<= far)) #Checks in the row 160 from the column at the beggining of the image (0) to the column in the middle of the image (120), where pixels in the table range can be found
+        rowI = np.where((depth[0:160,120] >= near) & (depth[0:160,120] <= far)) #Checks in the row 160 from the column at the beggining of the image (0) to the column in the middle of the image (120), where pixels in the table range can be found
+        columnF = np.where((depth[rowI[0][0]+10,120:239]<= near) | (depth[rowI[0][0]+10,120:239]>= far)) #The final column is taken from a border of the table (rowI+10) so the hands or the body won't interfere in the cutting as they will if the row selected was the middle were the user is
+        rowF = np.where((depth[160:319,((((columnF[0][0]+120)-columnI[0][0])/2)+columnI[0][0]).astype(int)]<= near) | (depth[160:319,((((columnF[0][0]+120)-columnI[0][0])/2)+columnI[0][0]).astype(int)]>= far)) #The final row is checked in the column just in the middle of the table (Middle between columnF and columnI)
+
+        #Due to the fact that coulmnF and rowF doesn't start in 0 their starting point to check have to be added, the 3 extra added and the 3 substracted from
+        #rowI and columnI is to have 3 extra lines of pixels to let the kinect see the epuck a little closer to the edge, due to the 25x25 pixel square is cutted per robot for the orientation
+        #The indexing is to find the first appeareance of the value searched (table depth for initials and floor depth for finals) the rowF doesn't takes the first appearance because there was some mistake in the detection in middle of the table not sure why
+        self.rows = slice(int(rowI[0][0]-3), min(int(rowF[0][2]+163), depth.shape[0]))
+        self.columns = slice(int(columnI[0][0]-3), min(int(columnF[0][0]+123), depth.shape[1]))
+        self.width = self.columns.stop - self.columns.start
+
+        #Lines of pixels around the borders used to check if the table moved, one inside the table and one outside for each side
+        first, last = self.rows.start, self.rows.stop - 1
+        left, right = self.columns.start, self.columns.stop - 1
+        self.across = np.array([first + 6, last - 6, max(first - 3, 0), min(last + 3, depth.shape[0] - 1)]) #Lines of the first axis, they go along the second axis
+        self.along = np.array([left + 6, right - 6, max(left - 3, 0), min(right + 3, depth.shape[1] - 1)]) #Lines of the second axis, they go along the first axis
+        self.reference = self.borders(depth) #Depth around the borders when the table was found
+        self.changed = 0
+        self.calibrations += 1
+
+    #Median depth of each line around the borders, the median ignores an arm or a robot covering only part of the line
+    def borders(self, depth):
+        across = np.median(depth[self.across, self.columns], axis = 1)
+        along = np.median(depth[self.rows, self.along], axis = 0)
+        return np.concatenate((across, along))
+
+    #Checks if the depth around at least two borders lines changed more than the tolerance
+    def drifted(self, depth):
+        return np.count_nonzero(np.absolute(self.borders(depth) - self.reference) > self.tolerance) >= 2
+
+    #Returns the table part of the depth image as a view
+    def cut(self, depth):
+        return depth[self.rows, self.columns]
+
+
+#Depth of the floor used as reference for all the game heights. Instead of the mean of the whole image every frame, it uses a fixed
+#subsample of pixels that were floor when the game started and smooths the value so the thresholds don't jitter between frames
+class FloorEstimator(object):
+
+    def __init__(self, samples = 512, alpha = 0.05, minimum = 2100):
+        self.samples = samples #Maximum number of floor pixels used
+        self.alpha = alpha #Weight of the new frame in the moving average
+        self.minimum = minimum #Depth in mm from where a pixel is considered floor
+        self.positions = None #Coordinates of the floor pixels used
+        self.level = None #Depth of the floor in mm
+
+    #Updates the floor depth with a new frame, the pixels to use are chosen again until the floor is found, like after blank frames
+    #while the kinect starts. Returns None while the floor hasn't been found
+    def update(self, depth):
+        if self.positions is None or self.level is None:
+            self.calibrate(depth)
+
+        values = depth[self.positions] #Only the subsample is read
+        values = values[values > self.minimum] #A person or an object over the floor pixels is ignored
+        if len(values) > 0:
+            self.set_level(np.mean(values) if self.level is None else (1 - self.alpha)*self.level + self.alpha*np.mean(values))
+        return self.level
+
+    #Chooses evenly distributed pixels from all the floor that can be seen
+    def calibrate(self, depth):
+        rows, columns = np.nonzero(depth > self.minimum)
+        step = max(len(rows)//self.samples, 1)
+        self.positions = rows[::step][:self.samples], columns[::step][:self.samples]
+        self.level = None
+
+    #Saves the floor depth and the heights of the game derived from it, a smaller depth means closer to the kinect so higher
+    def set_level(self, level):
+        self.level = level
+        self.arm = level/2.27, level/1.48 #Band where the arm used to point is, from its highest to its lowest part
+        self.robots = level/1.463, level/1.31 #Band of the robots over the table, anything closer to the kinect than its beginning is the arm
+        self.table = level/2.261, level/1.31 #Band used to find the table borders
+        self.fill = level/1.2435 #Depth written where the arm and the table borders are deleted
+
+
+#Preallocated images for each step between the table cutting and the selection, so no full images are created every frame
+#Each buffer belongs to one step: table and arm are written when the frame is cut, equalized, smoothed, robots and tails by the
+#robot detection and band by the selection, the rest are scratch images that any step can overwrite
+class Preprocessor(object):
+
+    def __init__(self):
+        self.shape = None #Size of the cut table, the buffers are created again only if the table borders change
+
+    def allocate(self, shape):
+        self.shape = shape
+        self.table = np.zeros(shape, dtype = np.uint16) #Depth of the table without the arm
+        self.arm = np.zeros(shape, dtype = np.uint16) #Depth of the table with the arm, used for the selection
+        self.equalized = np.zeros(shape, dtype = np.uint16) #Locally equalized table
+        self.smoothed = np.zeros(shape, dtype = np.uint16) #Equalized table after the local mean filter
+        self.robots = np.zeros(shape, dtype = bool) #Pixels of the robots
+        self.tails = np.zeros(shape, dtype = bool) #Pixels of the robots including their tails to find the orientation
+        self.band = np.zeros(shape, dtype = bool) #Pixels between two depths
+        self.labels = np.zeros(shape, dtype = np.int32) #Labels of the connected regions
+        self.mask = np.zeros(shape, dtype = bool) #Scratch mask
+        self.below = np.zeros(shape, dtype = bool) #Scratch mask
+        self.values = np.zeros(shape, dtype = np.uint32) #Scratch values
+
+    #Creates the buffers only if the image size changed
+    def reserve(self, shape):
+        if shape != self.shape:
+            self.allocate(shape)
+
+    #Cuts the table, flips it and deletes the arm, returns the table without the arm and the table with the arm
+    def run(self, depth, table, floor):
+        cut = table.cut(depth)
+        self.reserve(cut.shape)
+
+        np.copyto(self.table, cut[::-1]) #The image the kinect give is mirrored so it is flipped while it is copied
+
+        #Deletes the content of the 3 extra lines of pixels per side and clean also one line of the table in each side just to be sure there is no undesired pixel values in the table
+        self.table[0:4,:] = floor.fill
+        self.table[:,0:4] = floor.fill
+        self.table[-4:,:] = floor.fill
+        self.table[:,-4:] = floor.fill
+
+        np.copyto(self.arm, self.table) #The arm is kept for the selection
+        np.less_equal(self.table, floor.robots[0], out = self.mask) #Anything closer to the kinect than the robots is the arm
+        np.copyto(self.table, np.uint16(floor.fill), where = self.mask) #Deletes the arm
+        return self.table, self.arm
+
+    #Marks in band the pixels of the image between low (included) and high, returns the band
+    def between(self, image, low, high):
+        np.greater_equal(image, low, out = self.band)
+        np.less(image, high, out = self.mask)
+        np.logical_and(self.band, self.mask, out = self.band)
+        return self.band
+
+    #Mean of the pixels of the image greater than low and lower than high
+    def mean_between(self, image, low, high):
+        np.greater(image, low, out = self.mask)
+        np.less(image, high, out = self.below)
+        np.logical_and(self.mask, self.below, out = self.mask)
+        count = np.count_nonzero(self.mask)
+        if count == 0:
+            return 0
+        np.multiply(image, self.mask, out = self.values)
+        return self.values.sum()/count
+
+    #Bytes used by all the buffers, it is all the memory the steps need per frame
+    def footprint(self):
+        if self.shape is None:
+            return 0
+        return sum(buffer.nbytes for buffer in (self.table, self.arm, self.equalized, self.smoothed, self.robots, self.tails, self.band, self.labels, self.mask, self.below, self.values))
+
+
+#Pixels of the window used by the local equalization, shape is 'disk' or 'square' and the window has 2*radius+1 pixels per side
+def window(radius, shape = 'disk'):
+    y, x = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+    if shape == 'disk':
+        return x**2 + y**2 <= radius**2
+    if shape == 'square':
+        return np.ones(x.shape, dtype = bool)
+    raise ValueError('Unknown window shape ' + str(shape))
+
+#Local histogram equalization, each pixel gets the fraction of the pixels of its window that are lower or equal to it, like rank.equalize.
+#With tile = 1 the window is slid over the image one pixel of the footprint at a time, comparing the whole image shifted by that pixel
+#with itself, so each pixel counts its own window exactly and the output is the same as rank.equalize without building any histogram.
+#With bigger tiles the image is divided in tiles with one histogram of the window centered in each tile, and each pixel is interpolated
+#between the histograms of its 4 closest tiles, which is faster but changes the output up to tens of levels near the edges of the robots.
+#The histograms only have the values present in the frame, which for the table are a few hundreds, so all of them are made with one bincount
+class LocalEqualizer(object):
+
+    def __init__(self, radius = 14, shape = 'disk', tile = 1):
+        self.footprint = window(radius, shape) if isinstance(shape, str) else np.asarray(shape, dtype = bool) #shape can also be the footprint itself
+        self.radius = self.footprint.shape[0]//2 #Pixels the window goes beyond its center
+        self.tile = tile #Side in pixels of the tiles sharing a histogram
+        self.shape = None #Size of the image, the indexes are created again only if it changes
+
+    def allocate(self, shape):
+        self.shape = shape
+        r, t = self.radius, self.tile
+        self.padded = np.zeros((shape[0] + 2*r, shape[1] + 2*r), dtype = np.int32) #Values of the image replaced by their position in the sorted values, with a border that is never counted
+        self.result = np.zeros(shape[0]*shape[1], dtype = np.float64) #Fraction of the window lower or equal to each pixel
+
+        if t == 1:
+            self.offsets = list(zip(*np.nonzero(self.footprint))) #Shift of the image for each pixel of the window
+            self.lower = np.zeros(shape, dtype = bool) #Pixels lower or equal to the pixel of the window at one shift
+            self.count = np.zeros(shape, dtype = np.int32) #Pixels of the window lower or equal to each pixel
+
+            #Pixels of the window inside the image, the same every frame
+            inside = np.zeros(self.padded.shape, dtype = np.int32)
+            inside[r:r + shape[0], r:r + shape[1]] = 1
+            self.population = np.zeros(shape, dtype = np.float64)
+            for dy, dx in self.offsets:
+                self.population += inside[dy:dy + shape[0], dx:dx + shape[1]]
+            return
+
+        #Center of each tile, the last tiles can be smaller
+        rows = np.arange(0, shape[0], t)
+        columns = np.arange(0, shape[1], t)
+        rows = rows + (np.minimum(rows + t, shape[0]) - rows - 1)//2
+        columns = columns + (np.minimum(columns + t, shape[1]) - columns - 1)//2
+        self.tiles = len(rows)*len(columns)
+        centers = (rows[:,None]*self.padded.shape[1] + columns[None,:]).ravel() #Position in the padded image of the corner of the window of each tile
+
+        #Position in the padded image of each pixel of the window of each tile
+        dy, dx = np.nonzero(self.footprint)
+        self.indexes = (centers[:,None] + (dy*self.padded.shape[1] + dx)[None,:]).astype(np.intp)
+        self.windows = np.zeros(self.indexes.shape, dtype = np.int32) #Values of the window of each tile
+
+        #The pixels of the window outside the image are always the same so the population of each tile is known
+        inside = np.zeros(self.padded.shape, dtype = bool)
+        inside[r:r + shape[0], r:r + shape[1]] = True
+        population = inside.ravel()[self.indexes].sum(axis = 1)
+
+        #Each pixel is interpolated between the 4 closest tile centers, so there are no steps between the tiles
+        self.corners = [] #For each of the 4 corners, the tile of each pixel and the weight of the corner divided by the population of the tile
+        for rowWeight, rowTile in self.nearest(rows, shape[0]):
+            for columnWeight, columnTile in self.nearest(columns, shape[1]):
+                tiles = (rowTile[:,None]*len(columns) + columnTile[None,:]).ravel()
+                self.corners.append((tiles, (rowWeight[:,None]*columnWeight[None,:]).ravel()/population[tiles]))
+
+    #For each pixel of an axis of length size, the weight and the tile of the closest center before and after it
+    @staticmethod
+    def nearest(centers, size):
+        pixels = np.arange(size)
+        after = np.clip(np.searchsorted(centers, pixels), 0, len(centers) - 1)
+        before = np.clip(after - 1, 0, len(centers) - 1)
+        before[pixels >= centers[after]] = after[pixels >= centers[after]] #Pixels on a center or before the first one use only that center
+        distance = (centers[after] - centers[before]).astype(np.float64)
+        weight = np.where(distance > 0, (pixels - centers[before])/np.maximum(distance, 1), 0)
+        return (1 - weight, before), (weight, after)
+
+    #Equalizes the image (uint16), out can be a preallocated uint16 image
+    def run(self, image, out = None):
+        if image.shape != self.shape:
+            self.allocate(image.shape)
+        if out is None:
+            out = np.zeros(image.shape, dtype = np.uint16)
+
+        #The values are replaced by their order, the border gets one more than the biggest so it is never lower or equal to a pixel
+        values, codes = np.unique(image, return_inverse = True)
+        levels = len(values) + 1
+        r = self.radius
+        self.padded[:] = levels - 1
+        self.padded[r:r + image.shape[0], r:r + image.shape[1]] = codes.reshape(image.shape)
+
+        if self.tile == 1: #Pixels of each shifted window lower or equal to the center of the window
+            center = self.padded[r:r + image.shape[0], r:r + image.shape[1]]
+            self.count[:] = 0
+            for dy, dx in self.offsets:
+                np.less_equal(self.padded[dy:dy + image.shape[0], dx:dx + image.shape[1]], center, out = self.lower)
+                self.count += self.lower
+            np.divide(self.count, self.population, out = self.result.reshape(image.shape))
+        else:
+            #Cumulative histogram of the window of each tile, one row per tile
+            np.take(self.padded, self.indexes, out = self.windows)
+            self.windows += (np.arange(self.tiles)*levels)[:,None]
+            cumulative = np.bincount(self.windows.ravel(), minlength = self.tiles*levels).reshape(self.tiles, levels).cumsum(axis = 1).ravel()
+
+            #Fraction of the pixels of the window of each corner lower or equal to each pixel
+            codes = codes.ravel()
+            self.result[:] = 0
+            for tiles, weight in self.corners:
+                self.result += weight*cumulative[tiles*levels + codes]
+
+        bins = max(3, int(image.max())) + 1 #Same scale rank.equalize uses for 16 bits images
+        out.ravel()[:] = (bins - 1)*self.result
+        return out
+
+
+#Connected regions of a mask with the area, centroid and orientation of each one as arrays, ids has the label of each region
+class Regions(object):
+
+    def __init__(self, labels, count, area, centroid, orientation, ids = None):
+        self.labels = labels #Image with the label of each pixel, 0 is the background
+        self.count = count #Number of regions
+        self.area = area #Pixels of each region
+        self.centroid = centroid #Row and column of the center of each region, one row per region
+        self.orientation = orientation #Angle in radians of the major axis of each region
+        self.ids = np.arange(1, count + 1) if ids is None else ids #Label of each region in the labels image
+
+    def __len__(self):
+        return self.count
+
+    #Area of the biggest region, 0 if there is none
+    def largest(self):
+        return int(self.area.max()) if self.count > 0 else 0
+
+    #Keeps only the regions where keep is True, returns the mask of the regions kept and their measures. The mask is made with a table
+    #that says for each label if it is kept, so it is one lookup per pixel no matter how many regions are deleted, out can be a preallocated bool image
+    def keep(self, keep, out = None):
+        table = np.zeros(self.labels.max() + 1 if self.labels.size > 0 else 1, dtype = bool)
+        table[self.ids[keep]] = True
+        mask = np.take(table, self.labels, out = out)
+        return mask, Regions(self.labels, int(np.count_nonzero(keep)), self.area[keep], self.centroid[keep], self.orientation[keep], self.ids[keep])
+
+
+#Labels the connected regions of a mask and measures all of them with one bincount per moment, instead of one regionprops object per region
+class RegionLabeler(object):
+
+    def __init__(self):
+        self.grids = {} #Row and column of each pixel for each image size used
+
+    #Row and column of each pixel of an image of that shape, flattened
+    def coordinates(self, shape):
+        if shape not in self.grids:
+            rows, columns = np.indices(shape, dtype = np.float64)
+            self.grids[shape] = rows.ravel(), columns.ravel()
+        return self.grids[shape]
+
+    #Labels the mask, out can be a preallocated int32 image for the labels
+    def label(self, mask, out = None):
+        if out is None:
+            labels, count = measurements.label(mask)
+        else:
+            labels, count = out, measurements.label(mask, output = out)
+        return self.measure(labels, count)
+
+    #Measures the regions of an image already labeled with the labels from 1 to count
+    def measure(self, labels, count):
+        rows, columns = self.coordinates(labels.shape)
+        flat = labels.ravel()
+        size = count + 1
+
+        #Moments of order 0, 1 and 2 of each region, the background is dropped
+        area = np.bincount(flat, minlength = size)[1:size]
+        sums = [np.bincount(flat, weights = weights, minlength = size)[1:size] for weights in (rows, columns, rows*rows, columns*columns, rows*columns)]
+        count = len(area)
+        if count == 0:
+            return Regions(labels, 0, area, np.zeros((0, 2)), np.zeros(0))
+
+        row, column = sums[0]/area, sums[1]/area
+        #Central moments
+        mu20 = sums[2] - area*row*row
+        mu02 = sums[3] - area*column*column
+        mu11 = sums[4] - area*row*column
+
+        #Same orientation regionprops gives, the angle between the columns axis and the major axis
+        orientation = -0.5*np.arctan2(2*mu11, mu02 - mu20)
+        orientation[(mu02 == mu20) & (mu11 <= 0)] = np.pi/4
+        return Regions(labels, count, area, np.column_stack((row, column)), orientation)
+
+
+#Windows around the predicted position of each robot, so the detection only processes the table where the robots can be. The empty table
+#model finds the robots only inside the windows and their masks are copied side by side in one image (mosaic) that is cleaned and labeled
+#like the whole table. Each window has a margin around its center part so a robot in the center part is whole in the mosaic
+class SearchWindows(object):
+
+    def __init__(self, half = 16, margin = 14, period = 30):
+        self.half = half #Pixels from the predicted position to the border of the center part, how much a robot can move between frames
+        self.margin = margin #Pixels around the center part, more than the radius of a robot and the half side of the orientation squares
+        self.side = 2*(half + margin) #Size of each window
+        self.period = period #Frames between full scans even if no robot is lost
+        self.frames = 0 #Frames since the last full scan
+        self.lost = True #A robot was not found in the last frame, the table is scanned completely until all are found
+        self.centers = None #Predicted row and column of each robot
+        self.origins = None #Row and column of the table where each window starts
+        self.windows = [] #Slices of the table of each window
+        self.buffers = Preprocessor() #Buffers of the detection with the size of the mosaic
+
+    #Checks if the whole table has to be processed, force is used when the robots positions are not known
+    def full_scan(self, force = False):
+        if force or self.lost or self.frames >= self.period:
+            self.frames = 0
+            return True
+        self.frames += 1
+        return False
+
+    #Places a window around each predicted position (row, column) of the table, the windows near the border are moved inside the table so
+    #they can be cut as slices. Returns the slices of each window
+    def locate(self, positions, shape):
+        self.centers = np.rint(np.asarray(positions, dtype = np.float64).reshape(-1, 2)).astype(int)
+        self.origins = np.clip(self.centers - (self.half + self.margin), 0, np.subtract(shape, self.side))
+        self.windows = [(slice(row, row + self.side), slice(column, column + self.side)) for row, column in self.origins]
+        return self.windows
+
+    #Copies the windows of a mask of the table side by side in the mosaic
+    def gather(self, mask):
+        self.buffers.reserve((self.side, self.side*len(self.windows)))
+        mosaic = self.buffers.robots
+        for index, window in enumerate(self.windows):
+            mosaic[:, index*self.side:(index + 1)*self.side] = mask[window]
+        return mosaic
+
+    #Keeps the regions of the mosaic with the center less than half pixels from the predicted position of its window, returns them with
+    #the mask of the regions kept and the row and column to add to each center to have the table coordinates. A robot in two windows that
+    #overlap is kept only once
+    def place(self, regions, out = None):
+        window = np.clip((regions.centroid[:,1]//self.side).astype(int), 0, len(self.windows) - 1)
+        offsets = self.origins[window] - np.column_stack((np.zeros(len(window)), window*self.side))
+        positions = regions.centroid + offsets
+        keep = np.all(np.absolute(positions - self.centers[window]) < self.half, axis = 1)
+
+        for index in range(len(keep)):
+            if keep[index] and np.any(keep[:index] & (np.hypot(*(positions[:index] - positions[index]).T) < self.half)):
+                keep[index] = False
+        mask, regions = regions.keep(keep, out = out)
+        return mask, regions, offsets[keep]
+
+
+#Orientation of all the robots at once from the second order moments of the biggest region of a square around each of them. The squares
+#are cut from the mask with a border of empty pixels, so a robot near the edge gets a square like any other
+class OrientationEstimator(object):
+
+    def __init__(self, half = 12, opening = 1):
+        self.half = half #Pixels from the center to the border of the squares, they have 2*half pixels per side
+        self.opening = opening #Iterations of the opening that deletes the small areas next to the robot, with 0 the tail can be joined to them
+        self.padded = None #Mask with the border
+        self.labeler = RegionLabeler()
+        #The squares are stacked and labeled together but a region can't go from one square to an other
+        self.structure = np.zeros((3, 3, 3), dtype = bool)
+        self.structure[1] = [[0, 1, 0], [1, 1, 1], [0, 1, 0]]
+        self.square = np.ones((1, 2, 2), dtype = bool) #2x2 square of the opening applied to each square alone
+
+    #Returns the orientation in radians of each center (row, column) of the mask, the squares used and if each square was outside the mask
+    def run(self, mask, centers):
+        h = self.half
+        shape = (mask.shape[0] + 2*h, mask.shape[1] + 2*h)
+        if self.padded is None or self.padded.shape != shape:
+            self.padded = np.zeros(shape, dtype = bool)
+        self.padded[h:h + mask.shape[0], h:h + mask.shape[1]] = mask
+
+        centers = np.asarray(centers, dtype = np.float64).reshape(-1, 2)
+        count = len(centers)
+        corners = np.floor(centers - h).astype(int) #Corner of each square in the mask
+        clipped = np.any((corners < 0) | (corners + 2*h > mask.shape), axis = 1)
+        if count == 0:
+            return np.zeros(0), np.zeros((0, 2*h, 2*h), dtype = bool), clipped
+
+        #All the squares cut with one indexing, the corners are moved by the border
+        steps = np.arange(2*h)
+        rows = (corners[:,0] + h)[:,None,None] + steps[None,:,None]
+        columns = (corners[:,1] + h)[:,None,None] + steps[None,None,:]
+        squares = self.padded[rows, columns]
+        if self.opening > 0:
+            squares = morphology.binary_opening(squares, self.square, iterations = self.opening)
+
+        labels, regions = measurements.label(squares, structure = self.structure)
+        measures = self.labeler.measure(labels.reshape(count*2*h, 2*h), regions) #The moments don't depend on the position so the squares can be one over the other
+        orientation = np.zeros(count)
+        if regions > 0:
+            square = (measures.centroid[:,0]//(2*h)).astype(int)
+            order = np.lexsort((measures.ids, -measures.area, square)) #Biggest region of each square first, the first label if two are the same size
+            first = np.unique(square[order], return_index = True)[1]
+            orientation[square[order][first]] = measures.orientation[order][first]
+        return orientation, squares, clipped
+
+
+#Depth of the empty table per pixel, so the robots and the arm are the pixels higher than it. It is captured during the first frames
+#without the pixels where the robots and the arm were detected, and then follows slowly the pixels that are free, like a running median
+class BackgroundModel(object):
+
+    def __init__(self, frames = 30, noise = 3, minimum = 15, height = 120, step = 1, grow = 3):
+        self.frames = frames #Frames used to capture the table
+        self.noise = noise #Times the noise of each pixel a depth has to be higher than the table to be a robot
+        self.minimum = minimum #Minimum height in mm of a robot, used if the noise of a pixel is very small
+        self.height = height #Height in mm over the table from where it is the arm and not a robot
+        self.step = step #mm the table depth moves towards each new free value
+        self.grow = grow #Pixels the robots and the arm are made bigger before updating the free pixels, so their borders are not learned
+        #Growing grow times with a cross is the same as growing once with a diamond of radius grow, then the dilation writes directly in its output
+        self.structure = morphology.iterate_structure(morphology.generate_binary_structure(2, 1), grow) if grow > 0 else None
+        self.shape = None #Size of the table, if it changes the table is captured again
+
+    def allocate(self, shape):
+        self.shape = shape
+        self.samples = np.full((self.frames,) + shape, np.nan, dtype = np.float32) #Free depths of each frame while capturing
+        self.captured = 0 #Frames already captured
+        self.background = np.zeros(shape, dtype = np.float32) #Depth of the empty table
+        self.band = np.zeros(shape, dtype = np.float32) #Height over the table from where a pixel is a robot
+        self.half = np.zeros(shape, dtype = np.float32) #Height over the table from where a pixel is the tail of a robot
+        self.heights = np.zeros(shape, dtype = np.float32) #Height of each pixel over the table
+        self.change = np.zeros(shape, dtype = np.float32) #Movement of the table depth towards the new free values
+        self.robots = np.zeros(shape, dtype = bool)
+        self.tails = np.zeros(shape, dtype = bool)
+        self.arm = np.zeros(shape, dtype = bool)
+        self.busy = np.zeros(shape, dtype = bool) #Pixels of the robots or the arm
+        self.free = np.zeros(shape, dtype = bool)
+        self.mask = np.zeros(shape, dtype = bool) #Scratch mask
+
+    #Checks if the table was already captured
+    def ready(self):
+        return self.shape is not None and self.captured >= self.frames
+
+    #Finds the robots (higher than the noise band), their tails (higher than half of it) and the arm (higher than a robot) in the table with the arm.
+    #If windows (pairs of slices of the table) are given only the pixels inside them are found, the rest of the masks keeps the last values
+    def segment(self, depth, windows = None):
+        for window in (windows if windows is not None else [np.s_[:, :]]):
+            heights, mask, arm, robots, tails = self.heights[window], self.mask[window], self.arm[window], self.robots[window], self.tails[window]
+            np.subtract(self.background[window], depth[window], out = heights)
+            np.equal(depth[window], 0, out = mask)
+            np.copyto(heights, 0, where = mask) #The kinect didn't see those pixels
+            np.greater(heights, self.height, out = arm)
+            np.logical_not(arm, out = mask)
+            np.greater(heights, self.band[window], out = robots)
+            robots &= mask
+            np.greater(heights, self.half[window], out = tails)
+            tails &= mask
+        return self.robots, self.tails
+
+    #Learns the table from the pixels that are not the robots, the arm or unknown, depth is the table with the arm and robots the mask of the robots found
+    def learn(self, depth, robots, arm):
+        if depth.shape != self.shape:
+            self.allocate(depth.shape)
+
+        np.logical_or(robots, arm, out = self.busy)
+        if self.grow > 0:
+            morphology.binary_dilation(self.busy, structure = self.structure, output = self.free)
+            np.logical_not(self.free, out = self.free)
+        else:
+            np.logical_not(self.busy, out = self.free)
+        np.greater(depth, 0, out = self.mask)
+        self.free &= self.mask
+
+        if not self.ready():
+            sample = self.samples[self.captured]
+            sample[:] = np.nan
+            np.copyto(sample, depth, where = self.free)
+            self.captured += 1
+            if self.ready():
+                self.build()
+        else:
+            np.subtract(depth, self.background, out = self.change)
+            np.sign(self.change, out = self.change)
+            self.change *= self.step
+            np.add(self.background, self.change, out = self.background, where = self.free)
+
+    #Median of the captured frames and the noise of each pixel, the pixels never free take the value of the closest free pixel
+    def build(self):
+        seen = np.any(~np.isnan(self.samples), axis = 0)
+        if not np.any(seen):
+            self.captured = 0 #Nothing of the table could be seen, it is captured again
+            return
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) #Pixels never free have no median, they are filled next
+            median = np.nanmedian(self.samples, axis = 0)
+            noise = 1.4826*np.nanmedian(np.absolute(self.samples - median), axis = 0)
+        nearest = morphology.distance_transform_edt(~seen, return_distances = False, return_indices = True)
+        self.background[:] = median[tuple(nearest)]
+        noise = noise[tuple(nearest)]
+        self.band[:] = np.maximum(self.noise*np.nan_to_num(noise), self.minimum)
+        np.multiply(self.band, 0.5, out = self.half)
+        self.samples = None #The captured frames are not needed anymore
+
+
+#Plane z = A*x + B*y + C fitted by least squares to the points of the arm. Only the sums of the 3x3 normal equations are kept, so points can be
+#added in several parts and no table of points is built. The sums are centered before solving so the big coordinates don't lose precision
+class PlaneFitter(object):
+
+    def __init__(self):
+        self.reset()
+
+    #Forgets the points added
+    def reset(self):
+        self.n = 0
+        self.sums = np.zeros(9) #Sums of x, y, z, x*x, x*y, y*y, x*z, y*z and z*z
+
+    #Adds the points with coordinates x, y and z
+    def add(self, x, y, z):
+        x = np.asarray(x, dtype = np.float64).ravel()
+        y = np.asarray(y, dtype = np.float64).ravel()
+        z = np.asarray(z, dtype = np.float64).ravel()
+        self.n += len(x)
+        self.sums += [x.sum(), y.sum(), z.sum(), x.dot(x), x.dot(y), y.dot(y), x.dot(z), y.dot(z), z.dot(z)]
+
+    #Returns A, B and C of the plane with the points added, the pseudo inverse gives a solution even if the points are in a line
+    def solve(self):
+        n = self.n
+        sx, sy, sz, sxx, sxy, syy, sxz, syz, szz = self.sums
+        mx, my, mz = sx/n, sy/n, sz/n
+        normal = np.array([[sxx - n*mx*mx, sxy - n*mx*my], [sxy - n*mx*my, syy - n*my*my]])
+        A, B = np.linalg.pinv(normal).dot([sxz - n*mx*mz, syz - n*my*mz])
+        return A, B, mz - A*mx - B*my
+
+    #Fits the plane only to the points given
+    def fit(self, x, y, z):
+        self.reset()
+        self.add(x, y, z)
+        return self.solve()
+
+#Point (x0, y0) where a plane z = A*x + B*y + C crosses z = 0 over the line y = slope*x + intercept, works with arrays of planes and lines
+def intersection(A, B, C, slope, intercept):
+    y0 = (A*intercept - C*slope)/(A + B*slope)
+    x0 = (y0 - intercept)/slope
+    return x0, y0
+
+
+#Plane of the arm robust to the fingers, the sleeve and the noise of the depth. RANSAC with a fixed number of tries: each try is the plane of 3
+#random points and the one with more points closer than threshold wins, then the plane is fitted by least squares only to those points.
+#All the tries are evaluated together so the time is the same every frame
+class RobustPlaneFitter(PlaneFitter):
+
+    def __init__(self, iterations = 64, threshold = 2.0, seed = 0):
+        PlaneFitter.__init__(self)
+        self.iterations = iterations #Planes tried per fit
+        self.threshold = threshold #Maximum distance in z to the plane of a point that belongs to it
+        self.random = np.random.RandomState(seed) #Fixed seed so a recording gives always the same result
+        self.inliers = None #Points used in the last fit
+
+    def fit(self, x, y, z):
+        x = np.asarray(x, dtype = np.float64).ravel()
+        y = np.asarray(y, dtype = np.float64).ravel()
+        z = np.asarray(z, dtype = np.float64).ravel()
+        if len(x) < 4:
+            return PlaneFitter.fit(self, x, y, z)
+
+        #Plane of each group of 3 points solving z = A*x + B*y + C, groups with a repeated point or in a line give a singular system and are not used
+        samples = self.random.randint(0, len(x), (self.iterations, 3))
+        systems = np.stack((x[samples], y[samples], np.ones(samples.shape)), axis = 2)
+        usable = np.absolute(np.linalg.det(systems)) > 1e-9
+        if not np.any(usable):
+            return PlaneFitter.fit(self, x, y, z)
+        planes = np.linalg.solve(systems[usable], z[samples[usable]][:,:,None])[:,:,0]
+
+        #Points close to each plane, the plane with more of them is used
+        residuals = np.absolute(planes[:,0:1]*x + planes[:,1:2]*y + planes[:,2:3] - z)
+        best = np.argmax(np.count_nonzero(residuals <= self.threshold, axis = 1))
+        self.inliers = residuals[best] <= self.threshold
+        return PlaneFitter.fit(self, x[self.inliers], y[self.inliers], z[self.inliers])